@@ -0,0 +1,29 @@
+"""Helpers shared by the benchmarks. Run the benchmarks from the repository root, e.g. `python benchmarks/lexer.py`."""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeTosh:
+    """Minimal stand-in for the `Tosh` application object, without any UI."""
+
+    def __init__(self):
+        """Initialize an empty session."""
+        from tosh.ui.style import ToshStyle
+        self.variables = {}
+        self.style = ToshStyle('default')
+        self.config = None
+
+    def refresh(self, immediate=False):
+        """Nothing to redraw."""
+        pass
+
+
+def per_call(func, number):
+    """Return the average time of calling `func` `number` times, in microseconds."""
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number * 1e6
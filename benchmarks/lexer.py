@@ -0,0 +1,52 @@
+"""
+Cost of building command line lexers and statements.
+
+Compares building a PLY lexer from scratch (what every statement used to do) with cloning the shared master lexer.
+"""
+import argparse
+import tempfile
+
+from common import FakeTosh, per_call
+
+from ply import lex
+
+from tosh.parser import CommandLineLexer
+from tosh.statements import CommandStatement
+
+
+def _lex_from_scratch(tosh):
+    lexer = CommandLineLexer.__new__(CommandLineLexer)
+    lexer._tosh = tosh
+    lexer.lexer = lex.lex(module=lexer)
+    return lexer
+
+
+def _statement(tosh):
+    statement = CommandStatement(tosh, None)
+    statement.set_cmdline('x = echo "hello" 42')
+    return statement
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--number', type=int, default=2000, help='iterations per measurement')
+    args = parser.parse_args()
+    tosh = FakeTosh()
+
+    with tempfile.TemporaryDirectory() as tabdir:
+        print('Master lexer, generating lextab:  {:>10.1f} us'.format(
+            per_call(lambda: CommandLineLexer.load_tables(tabdir), 1)))
+        print('Master lexer, reading lextab:     {:>10.1f} us'.format(
+            per_call(lambda: CommandLineLexer.load_tables(tabdir), 20)))
+    print('Master lexer, without lextab:     {:>10.1f} us'.format(
+        per_call(lambda: CommandLineLexer.load_tables(), 20)))
+
+    before = per_call(lambda: _lex_from_scratch(tosh), args.number)
+    after = per_call(lambda: CommandLineLexer(tosh), args.number)
+    print('Lexer, lex.lex() per instance:    {:>10.1f} us'.format(before))
+    print('Lexer, clone of master lexer:     {:>10.1f} us  ({:.0f}x)'.format(after, before / after))
+    print('Statement with command line:      {:>10.1f} us'.format(per_call(lambda: _statement(tosh), args.number)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Memory used by tasks and list items.
+
+Measures the bytes allocated per finished task of a wide fan-out (including its rendered tokens) and per item of a
+list of strings, with tracemalloc.
+"""
+import argparse
+import asyncio
+import gc
+import tracemalloc
+
+from common import FakeTosh
+
+from tosh.tasks import task, Task
+from tosh.vars.basic import List, String
+
+
+@task('Processing item {pos[0]}')
+async def _item(index, *, task):
+    return index
+
+
+def _fan_out(tosh, number):
+    root = Task(tosh)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(root.parallel([(_item, (index,), {}) for index in range(number)]))
+    # A failed child makes the finished children show, so their tokens are rendered too
+    root._children[-1]._status = Task.Status.Error
+    root.tokens()
+    return root
+
+
+def _list(tosh, number):
+    return List(String, [String(tosh, 'item {}'.format(index)) for index in range(number)])
+
+
+def _bytes_per(func, number):
+    """Return the bytes still allocated after calling `func`, divided by `number`."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return (after - before) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--number', type=int, default=10000, help='tasks and list items')
+    args = parser.parse_args()
+    tosh = FakeTosh()
+
+    print('Per task (with tokens):  {:>8.0f} bytes'.format(_bytes_per(lambda: _fan_out(tosh, args.number),
+                                                                      args.number)))
+    print('Per list item:           {:>8.0f} bytes'.format(_bytes_per(lambda: _list(tosh, args.number),
+                                                                      args.number)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Cost of receiving the output of console commands.
+
+Feeds synthetic outputs in small chunks to a console handler, as asyncssh does, both as many short lines (e.g: a wide
+psql result) and as a single long line (e.g: a big `to_json`). Compares with the previous implementation, which
+concatenated and split the buffers on every chunk (quadratic, so measured with smaller outputs).
+"""
+import argparse
+import time
+
+import common  # noqa: F401 (sets the path)
+
+from tosh.lib.ssh import SSHPsqlHandler
+
+
+class _PreviousHandler(SSHPsqlHandler):
+    """The previous implementation of `data_received`."""
+
+    def __init__(self, session):
+        super().__init__(session)
+        self._out_buffer = ''
+        self._line_buffer = ''
+
+    def data_received(self, data, _):
+        self._out_buffer += data
+        self._line_buffer += data
+        lines = self._line_buffer.split('\n')
+        self._line_buffer = lines[-1]
+        if any(self._PROMPT_MATCHER.search(l) for l in lines):
+            self._at_prompt = True
+
+    def result(self):
+        return '\n'.join(self._out_buffer.split('\n')[1:-1])
+
+
+def _output(megabytes, line_length):
+    line = 'x' * (line_length - 1) + '\n'
+    body = line * (megabytes * 1024 * 1024 // line_length)
+    return 'SELECT * FROM big;\n' + body + 'postgres=# '
+
+
+def _receive(handler_class, output, chunk_size):
+    """Return the seconds to receive the output in chunks and get the command result."""
+    handler = handler_class(None)
+    start = time.perf_counter()
+    for offset in range(0, len(output), chunk_size):
+        handler.data_received(output[offset:offset + chunk_size], None)
+    result = handler.result() if isinstance(handler, _PreviousHandler) else handler._output.text()
+    elapsed = time.perf_counter() - start
+    assert handler._at_prompt and len(result) == len(output) - len('SELECT * FROM big;\n') - len('\npostgres=# ')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-m', '--megabytes', type=int, default=50, help='size of the outputs')
+    parser.add_argument('-p', '--previous-megabytes', type=int, default=2, help='size for the previous implementation')
+    parser.add_argument('-c', '--chunk-size', type=int, default=4096, help='bytes per chunk')
+    args = parser.parse_args()
+
+    for name, line_length in (('short lines', 100), ('single line', 10 ** 12)):
+        for handler_class, megabytes in ((_PreviousHandler, args.previous_megabytes), (SSHPsqlHandler, args.megabytes)):
+            length = min(line_length, megabytes * 1024 * 1024)
+            elapsed = _receive(handler_class, _output(megabytes, length), args.chunk_size)
+            print('{:<12} {:<8} {:>4} MB: {:>8.2f} s  ({:>8.1f} ms/MB)'.format(
+                name, 'previous' if handler_class is _PreviousHandler else 'current', megabytes, elapsed,
+                elapsed / megabytes * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Tests of the each command.
+
+Run from the repository root with `python -m unittest discover -s tests`.
+"""
+import asyncio
+import unittest
+
+from tosh.command import Command
+from tosh.commands.each import EachCommand, _ValueTask
+from tosh.vars.basic import List, String
+
+
+class _FakeTosh:
+    """Application object running one item at a time."""
+
+    class config:
+        @staticmethod
+        def get(*keys):
+            return 1 if keys == ('tasks', 'max_parallel') else None
+
+    def refresh(self, immediate=False):
+        pass
+
+
+class _Placeholder:
+    bare_word = EachCommand.PLACEHOLDER
+
+
+class _SleepyCommand(Command):
+    """Sleeps for a while, recording the items started and cancelled."""
+
+    title = 'Sleepy'
+
+    command = 'test_sleepy'
+
+    started = []
+    cancelled = []
+
+    async def _run(self):
+        item = await self.sub(self._arguments[0])
+        _SleepyCommand.started.append(item.string)
+        try:
+            await asyncio.sleep(0.2)
+        except asyncio.CancelledError:
+            _SleepyCommand.cancelled.append(item.string)
+            raise
+
+
+class EachTest(unittest.TestCase):
+    def test_cancelling_cancels_the_items(self):
+        tosh = _FakeTosh()
+        items = List(String, [String(tosh, str(number)) for number in range(3)])
+        each = EachCommand(tosh, [_ValueTask(tosh, items, 'items'), _SleepyCommand, _Placeholder()])
+
+        async def run():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(each.run(), 0.1)
+            # Long enough for the queued items to start, if they were not cancelled
+            await asyncio.sleep(0.5)
+
+        asyncio.get_event_loop().run_until_complete(run())
+        self.assertEqual(_SleepyCommand.started, ['0'])
+        self.assertEqual(_SleepyCommand.cancelled, ['0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,351 @@
+"""
+Tests of the SSH library, with fake sessions instead of SSH channels.
+
+Run from the repository root with `python -m unittest discover -s tests`.
+"""
+import asyncio
+import shutil
+import subprocess
+import unittest
+
+from tosh.lib import ssh
+from tosh.lib.ssh import SSHRailsHandler
+from tosh.tasks import Task
+from tosh.variable import VariableStore
+
+_PROMPT = 'irb(main):001:0> '
+
+
+class _FakeRailsSession:
+    """Session answering each command line by running it with a local Ruby, like a Rails console would."""
+
+    def __init__(self, delay=0):
+        self.channel = self
+        self.written = []
+        self._delay = delay
+        self.handler = SSHRailsHandler(self)
+        self.handler.data_received(_PROMPT, None)
+
+    def write(self, data):
+        self.written.append(data)
+        if data == '\x03':
+            self._answer('^C\n' + _PROMPT)
+        elif data.endswith('\n'):
+            output = subprocess.run(['ruby', '-rjson', '-e', data], stdout=subprocess.PIPE,
+                                    universal_newlines=True).stdout
+            self._answer(data + output + '=> nil\n' + _PROMPT)
+
+    def _answer(self, data):
+        asyncio.get_event_loop().call_later(self._delay, self.handler.data_received, data, None)
+
+
+class _SilentSession:
+    """Session that never answers commands, until closed with `lose`."""
+
+    def __init__(self, handler_class=SSHRailsHandler):
+        self.channel = self
+        self.written = []
+        self.handler = handler_class(self)
+        self.handler.data_received(_PROMPT, None)
+
+    def write(self, data):
+        self.written.append(data)
+
+    def lose(self, delay):
+        asyncio.get_event_loop().call_later(delay, self.handler.connection_lost, OSError('reset'))
+
+
+def _run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+@unittest.skipUnless(shutil.which('ruby'), 'needs ruby')
+class RailsBatchTest(unittest.TestCase):
+    def test_bad_expressions_only_fail_their_own_call(self):
+        session = _FakeRailsSession()
+        commands = ['1 + 1', 'User.find(', '"unbalanced', 'raise "boom"', '{a: "x#{1 + 1}"}', '"quote \\" #"']
+        results = _run(session.handler.get_objects(commands))
+
+        self.assertEqual(len(session.written), 1)
+        self.assertEqual(results[0], 2)
+        self.assertIn('SyntaxError', str(results[1]))
+        self.assertIn('SyntaxError', str(results[2]))
+        self.assertEqual(str(results[3]), 'RuntimeError: boom')
+        self.assertEqual(results[4], {'a': 'x2'})
+        self.assertEqual(results[5], 'quote " #')
+
+    def test_calls_in_the_same_iteration_are_batched(self):
+        session = _FakeRailsSession()
+        results = _run(asyncio.gather(*[session.handler.get_object(str(number)) for number in range(3)]))
+        self.assertEqual(results, [0, 1, 2])
+        self.assertEqual(len(session.written), 1)
+
+    def test_batch_is_interrupted_when_all_callers_are_cancelled(self):
+        session = _FakeRailsSession(delay=10)
+
+        async def cancel_all():
+            calls = [asyncio.ensure_future(session.handler.get_object('1')) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            for call in calls:
+                call.cancel()
+            await asyncio.sleep(0.01)
+
+        _run(cancel_all())
+        self.assertEqual(session.written[-1], '\x03')
+
+
+class ConnectionLostTest(unittest.TestCase):
+    def test_running_command_fails(self):
+        session = _SilentSession()
+        session.lose(0.01)
+        with self.assertRaisesRegex(ConnectionError, 'reset'):
+            _run(session.handler.run_command('sleep 10'))
+        self.assertTrue(session.handler.closed)
+
+    def test_later_commands_fail(self):
+        session = _SilentSession()
+        session.handler.connection_lost(None)
+        with self.assertRaises(ConnectionError):
+            _run(session.handler.run_command('1'))
+
+    def test_stream_fails_after_the_lines_received(self):
+        session = _SilentSession()
+
+        async def read():
+            lines = []
+            async with session.handler.stream_command('tail -f log') as stream:
+                session.handler.data_received('tail -f log\nfirst\n', None)
+                session.lose(0.01)
+                try:
+                    async for line in stream:
+                        lines.append(line)
+                except ConnectionError:
+                    return lines
+
+        self.assertEqual(_run(read()), ['first'])
+        self.assertFalse(session.handler._lock.locked())
+
+
+class _FakeTosh:
+    """Application object with an empty configuration."""
+
+    class config:
+        @staticmethod
+        def get(*_):
+            return None
+
+    def refresh(self, immediate=False):
+        pass
+
+
+class _FakePooledSession(ssh._SSHSwitchableSession):
+    """Switchable session without an SSH channel."""
+
+    @classmethod
+    async def create_session(cls, connection, tosh):
+        await asyncio.sleep(0.01)
+        return cls(connection, SSHRailsHandler)
+
+
+class _FakeVariable:
+    """Variable that isn't a list."""
+
+    def type(self):
+        return self
+
+    class_name = 'Fake'
+
+    def forget_attributes(self):
+        return 0
+
+
+class _FlakySession(_FakePooledSession):
+    """Pooled session failing to open every other time."""
+
+    opened = 0
+
+    @classmethod
+    async def create_session(cls, connection, tosh):
+        cls.opened += 1
+        if cls.opened % 2 == 0:
+            raise OSError('refused')
+        return await super().create_session(connection, tosh)
+
+
+class GetSessionTest(unittest.TestCase):
+    def test_concurrent_callers_get_different_sessions(self):
+        tosh = _FakeTosh()
+        connection = ssh._SSHConnection(tosh, 'example.com')
+        connection._ready.set_result(None)
+        root = Task(tosh)
+
+        async def get_two():
+            return await asyncio.gather(root.sub(connection.get_session, _FakePooledSession),
+                                        root.sub(connection.get_session, _FakePooledSession))
+
+        first, second = _run(get_two())
+        self.assertIsNot(first._handler, second._handler)
+
+        async def use(session):
+            async with session:
+                pass
+
+        _run(use(first))
+        third = _run(root.sub(connection.get_session, _FakePooledSession))
+        self.assertIs(third, first)
+
+
+class SessionPoolTest(unittest.TestCase):
+    def test_prewarm_releases_the_sessions_opened_if_some_fail(self):
+        connection = ssh._SSHConnection(_FakeTosh(), 'example.com')
+        connection._ready.set_result(None)
+        pool = connection.pool(_FlakySession)
+        _FlakySession.opened = 0
+
+        with self.assertRaisesRegex(OSError, 'refused'):
+            _run(pool.prewarm(3))
+        stats = pool.stats()
+        self.assertEqual((stats.in_use, stats.idle), (0, 2))
+
+    def test_waiters_open_sessions_when_one_is_discarded(self):
+        connection = ssh._SSHConnection(_FakeTosh(), 'example.com')
+        connection._ready.set_result(None)
+        pool = connection.pool(_FakePooledSession)
+        pool.max_sessions = 1
+
+        async def wait_and_discard():
+            in_use = await pool.acquire()
+            waiting = [asyncio.ensure_future(pool.acquire()) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            pool.discard(in_use)
+            first = await asyncio.wait_for(waiting[0], 1)
+            pool.release(first)
+            return first, await asyncio.wait_for(waiting[1], 1)
+
+        first, second = _run(wait_and_discard())
+        self.assertIs(first, second)
+        self.assertEqual(pool.stats().waiters, 0)
+
+
+async def _refuse():
+    raise OSError('refused')
+
+
+class CommandStreamTest(unittest.TestCase):
+    def test_needs_async_with(self):
+        session = _SilentSession()
+
+        async def read():
+            async for _ in session.handler.stream_command('tail -f log'):
+                pass
+
+        with self.assertRaises(RuntimeError):
+            _run(read())
+        self.assertEqual(session.written, [])
+        self.assertFalse(session.handler._lock.locked())
+
+    def test_leaving_early_interrupts_and_unlocks(self):
+        session = _SilentSession()
+
+        async def read():
+            async with session.handler.stream_command('tail -f log') as stream:
+                session.handler.data_received('tail -f log\nfirst\nsecond\n', None)
+                asyncio.get_event_loop().call_later(0.01, session.handler.data_received, '^C\n' + _PROMPT, None)
+                async for line in stream:
+                    return line
+
+        self.assertEqual(_run(read()), 'first')
+        self.assertEqual(session.written, ['tail -f log\n', '\x03'])
+        self.assertFalse(session.handler._lock.locked())
+
+
+class StreamListTest(unittest.TestCase):
+    def test_lines_fill_the_list(self):
+        session = _SilentSession()
+        lines = session.handler.stream_list(_FakeTosh(), 'SELECT name FROM users;')
+
+        async def read():
+            await asyncio.sleep(0)
+            session.handler.data_received('SELECT name FROM users;\nalice\nbob\n' + _PROMPT, None)
+            return await lines.items()
+
+        self.assertEqual([item.string for item in _run(read())], ['alice', 'bob'])
+        self.assertIsNone(lines.error)
+        self.assertFalse(session.handler._lock.locked())
+
+    def test_stopped_when_no_variable_stores_it(self):
+        session = _SilentSession()
+        lines = session.handler.stream_list(_FakeTosh(), 'tail -f log')
+        variables = VariableStore()
+
+        async def assign():
+            variables['a'] = lines
+            variables['b'] = lines
+            variables['a'] = _FakeVariable()
+            await asyncio.sleep(0.01)
+            self.assertFalse(lines.finished)
+            asyncio.get_event_loop().call_later(0.01, session.handler.data_received, '^C\n' + _PROMPT, None)
+            del variables['b']
+            while not lines.finished:
+                await asyncio.sleep(0.01)
+
+        _run(assign())
+        self.assertEqual(lines.error, 'stopped')
+        self.assertEqual(session.written, ['tail -f log\n', '\x03'])
+        self.assertFalse(session.handler._lock.locked())
+
+
+class _FakeSSHConnection:
+    """asyncssh connection counting the commands run, closed with `close`."""
+
+    def __init__(self):
+        self.runs = 0
+        self._closed = asyncio.get_event_loop().create_future()
+
+    async def run(self, command):
+        self.runs += 1
+
+    def close(self):
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    async def wait_closed(self):
+        await self._closed
+
+
+class HealthTest(unittest.TestCase):
+    def _probes(self, interval):
+        connection = ssh._SSHConnection(None, 'example.com')
+        connection.connection = _FakeSSHConnection()
+        asyncio.get_event_loop().call_later(0.05, connection.connection.close)
+        _run(connection._wait_until_unhealthy(interval, 1))
+        return connection.connection.runs
+
+    def test_probes_every_interval(self):
+        self.assertGreater(self._probes(0.01), 1)
+
+    def test_no_probes_without_interval(self):
+        self.assertEqual(self._probes(0), 0)
+        self.assertEqual(self._probes(None), 0)
+
+
+class ReconnectTest(unittest.TestCase):
+    def test_gives_up_after_the_timeout(self):
+        async def reconnect():
+            connection = ssh._SSHConnection(None, 'example.com')
+            connection.connect = _refuse
+            ssh._connections['example.com'] = connection
+            waiting = asyncio.ensure_future(connection.wait_connected())
+            reconnected = await connection._reconnect(1, 0.5)
+            with self.assertRaisesRegex(ConnectionError, 'refused'):
+                await waiting
+            return connection, reconnected
+
+        connection, reconnected = _run(reconnect())
+        self.assertFalse(reconnected)
+        self.assertFalse(connection.connected)
+        self.assertNotIn('example.com', ssh._connections)
+
+
+if __name__ == '__main__':
+    unittest.main()
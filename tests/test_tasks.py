@@ -0,0 +1,79 @@
+"""
+Tests of the task manager.
+
+Run from the repository root with `python -m unittest discover -s tests`.
+"""
+import unittest
+
+from prompt_toolkit.token import Token
+
+from tosh.headless import _TextStyle
+from tosh.tasks import Task, TaskManager
+
+
+class _FakeTosh:
+    style = _TextStyle('default')
+
+    def refresh(self, immediate=False):
+        pass
+
+
+class _FakeArchive:
+    def archive(self, task):
+        archived = Task(task._tosh)
+        archived._set_output_text('archived')
+        return archived
+
+
+class TaskManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.tosh = _FakeTosh()
+
+    def _task(self, text):
+        task = Task(self.tosh)
+        task._set_output_text(text)
+        return task
+
+    def _joined(self, manager):
+        tokens = []
+        for index, task in enumerate(manager._tasks):
+            if index > 0:
+                tokens.append((Token.Task.Separator, '\n'))
+            tokens += task.tokens()
+        return tokens
+
+    def test_tokens_of_changed_tasks_are_joined_again(self):
+        manager = TaskManager(self.tosh)
+        tasks = [self._task(str(i)) for i in range(3)]
+        for task in tasks:
+            manager.add(task)
+        first_tokens = tasks[0].tokens()
+        self.assertEqual(manager.get_tokens(None), self._joined(manager))
+
+        tasks[1]._add_child(self._task('child'))
+        tasks[2]._set_output_text('changed')
+        tokens = manager.get_tokens(None)
+        self.assertEqual(tokens, self._joined(manager))
+        self.assertIs(tasks[0].tokens(), first_tokens)
+
+        manager.add(self._task('3'))
+        tasks[1]._children[0]._set_output_text('changed child')
+        self.assertEqual(manager.get_tokens(None), self._joined(manager))
+
+    def test_archived_tasks_are_joined_again(self):
+        manager = TaskManager(self.tosh, archive=_FakeArchive(), max_tasks=2)
+        tasks = [self._task(str(i)) for i in range(3)]
+        for task in tasks[:2]:
+            task._status = Task.Status.Success
+            manager.add(task)
+        manager.get_tokens(None)
+
+        manager.add(tasks[2])
+        self.assertIsNot(manager._tasks[0], tasks[0])
+        self.assertEqual(manager.get_tokens(None), self._joined(manager))
+        tasks[0]._set_output_text('gone')
+        self.assertEqual(manager._first_changed, len(manager._tasks))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Append-only archive of finished task trees, to keep only a summary of old tasks in memory."""
+import json
+import time
+
+from prompt_toolkit.token import Token
+
+from .tasks import Task
+
+
+class TaskArchive:
+    """Archive of task trees, stored in a file as JSON lines."""
+
+    def __init__(self, path):
+        """Initialize the archive stored in the given path. The file is created when the first task is archived."""
+        self.path = path
+
+    def archive(self, task):
+        """Write a finished task tree to the archive. Return an `ArchivedTask` summary to replace it."""
+        record = {
+            'time':   time.time(),
+            'title':  ''.join(token[1] for token in task._status_line_tokens),
+            'status': task._status.name,
+            'lines':  task.text_lines()
+        }
+        with open(self.path, 'a') as fh:
+            offset = fh.tell()
+            fh.write(json.dumps(record) + '\n')
+        return ArchivedTask(task._tosh, self, offset, task._status, task._status_line_tokens)
+
+    def read(self, offset):
+        """Return the record of an archived task given its offset in the file."""
+        with open(self.path) as fh:
+            fh.seek(offset)
+            return json.loads(fh.readline())
+
+    def search(self, text):
+        """Return the records of all archived tasks containing the given text, case insensitive, oldest first."""
+        text = text.lower()
+        try:
+            with open(self.path) as fh:
+                for line in fh:
+                    record = json.loads(line)
+                    if any(text in l.lower() for l in record['lines']):
+                        yield record
+        except FileNotFoundError:
+            return
+
+
+class ArchivedTask(Task):
+    """Summary of an archived task, showing only its status line. Click it to show or hide the archived lines."""
+
+    def __init__(self, tosh, archive, offset, status, status_line_tokens):
+        """Create the summary of a task archived at the given offset."""
+        super().__init__(tosh)
+        self._archive = archive
+        self._offset = offset
+        self._status = status
+        # Tokens may have the mouse handler of the archived task, which must not be kept alive or clicked
+        self._status_line_tokens = [self._token(token[1], token[0]) for token in status_line_tokens] + [
+            self._token(' (archived)', Token.Task.Archived)]
+
+    @property
+    def archivable(self):
+        """Already archived."""
+        return False
+
+    def approximate_size(self):
+        """Only the summary is kept in memory."""
+        return 0
+
+    def _clicked(self):
+        if self._output_token_lines:
+            self._output_token_lines = []
+        else:
+            # The first line is the status line, already shown
+            lines = self._archive.read(self._offset)['lines'][1:]
+            self._output_token_lines = [[self._token(line, Token.Task.Archived)] for line in lines]
+        self._tosh.refresh()
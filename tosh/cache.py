@@ -0,0 +1,62 @@
+"""Opt-in caches for the results of variable loads and tasks."""
+from collections import OrderedDict, namedtuple
+import time
+
+CacheStats = namedtuple('CacheStats', ['name', 'hits', 'misses', 'entries', 'max_entries', 'ttl'])
+
+
+class ResultCache:
+    """
+    Cache of results with a time to live, evicting the least recently used entries when full.
+
+    Declare a cache in a `Variable` subclass (`result_cache = ResultCache('User')`) to cache its loads by argument, or
+    pass it to the task decorator (`@task('Title', cache=ResultCache('title'))`) to cache calls by arguments. All
+    caches are listed in `ResultCache.all`, for the `cache` command.
+    """
+
+    all = []
+
+    def __init__(self, name, ttl=300, max_entries=256):
+        """Create a named cache, keeping up to `max_entries` results for `ttl` seconds."""
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        ResultCache.all.append(self)
+
+    def get(self, key):
+        """Return a (found, value, age in seconds) tuple for a key, counting hits and misses."""
+        try:
+            entry_time, value = self._entries[key]
+        except (KeyError, TypeError):
+            # TypeError: unhashable key, never cached
+            self.misses += 1
+            return False, None, None
+        age = time.monotonic() - entry_time
+        if age > self.ttl:
+            del self._entries[key]
+            self.misses += 1
+            return False, None, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, value, age
+
+    def put(self, key, value):
+        """Store a result, evicting the least recently used one if full."""
+        try:
+            self._entries[key] = (time.monotonic(), value)
+        except TypeError:
+            return
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries."""
+        self._entries.clear()
+
+    def stats(self):
+        """Return the statistics of this cache."""
+        return CacheStats(self.name, self.hits, self.misses, len(self._entries), self.max_entries, self.ttl)
@@ -1,7 +1,9 @@
 """Base class and task for commands."""
+import asyncio
 import traceback
 
-from .tasks import Task
+from . import generation
+from .tasks import Task, run_limited
 
 
 class CommandFailedException(BaseException):
@@ -37,6 +39,7 @@ class _CommandMeta(type):
         # Register this command
         if hasattr(self, 'command'):
             self.all_commands[self.command] = self
+            generation.bump()
 
 
 class Command(Task, metaclass=_CommandMeta):
@@ -46,12 +49,28 @@ class Command(Task, metaclass=_CommandMeta):
     To implement a command, inherit from this class and:
      - Include a class attribute `command = "cmd"` to specify the name of the command.
      - Implement a coroutine _run() which runs the command.
+
+    When running scripts, statements run concurrently unless they use the same variables. Commands with a `barrier`
+    class attribute set to True wait for all the previous statements, and all the later statements wait for them.
+
+    Statements are cancelled after the `tasks: timeout` config option (in seconds). Commands can override it with a
+    `timeout` class attribute.
+
+    Commands with a `concurrent_arguments` class attribute set to True run all their task arguments concurrently (see
+    `resolve_arguments`) before `_run`. Then `sub()` on an argument returns its result right away.
     """
 
+    barrier = False
+
+    timeout = None
+
+    concurrent_arguments = False
+
     def __init__(self, tosh, arguments):
         """Initialize the command, given its arguments (list of tasks or bare words)."""
         super().__init__(tosh)
         self._arguments = arguments
+        self._resolved = {}
         self._output = []
         self._status_line_tokens = [self._token(self.title)]
 
@@ -60,9 +79,14 @@ class Command(Task, metaclass=_CommandMeta):
         self._status = Task.Status.Running
         self._tosh.refresh()
         try:
+            if self.concurrent_arguments:
+                await self.resolve_arguments()
             result = await self._run()
             self._status = Task.Status.Success
             return result
+        except asyncio.CancelledError:
+            self._status = Task.Status.Cancelled
+            raise
         except CommandFailedException:
             self._status = Task.Status.Error
             raise CommandFailedException()
@@ -73,6 +97,48 @@ class Command(Task, metaclass=_CommandMeta):
         finally:
             self._tosh.refresh()
 
+    @classmethod
+    def plan_return_type(cls, arguments):
+        """
+        Return the type the command returns when called with the given arguments (plans, bare words or commands).
+
+        By default, the `return_type` class attribute. Override for commands whose type depends on their arguments.
+        """
+        return cls.return_type
+
+    async def resolve_arguments(self):
+        """
+        Run all the task arguments concurrently, at most `tasks: max_parallel` (config) at a time, keeping their
+        results.
+
+        If any argument fails, all of them are still waited for, and the failures are reported in the output.
+        """
+        tasks = [argument for argument in self._arguments if isinstance(argument, Task)]
+        limit = self._max_parallel()
+        semaphore = asyncio.Semaphore(limit) if limit else None
+        for argument in tasks:
+            self._add_child(argument)
+        results = await asyncio.gather(*[run_limited(argument, semaphore) for argument in tasks],
+                                       return_exceptions=True)
+
+        failures = []
+        for argument, result in zip(tasks, results):
+            if isinstance(result, BaseException):
+                reason = 'see above' if isinstance(result, CommandFailedException) else repr(result)
+                failures.append('Argument {} ({}) failed: {}'.format(
+                    self._arguments.index(argument) + 1, getattr(argument, 'bare_word', '?'), reason))
+            else:
+                self._resolved[argument] = result
+        if failures:
+            self._set_output_text('\n'.join(failures))
+            raise CommandFailedException()
+
+    async def sub(self, task_or_func, *args, **kwargs):
+        """Run a subtask, see `Task.sub`. Arguments already run by `resolve_arguments` return their result."""
+        if task_or_func in self._resolved:
+            return self._resolved[task_or_func]
+        return await super().sub(task_or_func, *args, **kwargs)
+
     @staticmethod
     def completions():
         return []
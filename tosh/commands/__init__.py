@@ -1 +1,7 @@
 from .exit import ExitCommand
+from .archive import ArchiveCommand
+from .stats import StatsCommand
+from .profile import ProfileCommand
+from .cache import CacheCommand
+from .refresh import RefreshCommand
+from .each import EachCommand
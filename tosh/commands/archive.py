@@ -0,0 +1,29 @@
+"""Command to search the archive of old tasks."""
+from prompt_toolkit.token import Token
+
+from ..command import Command
+
+
+class ArchiveCommand(Command):
+    """Searches archived tasks. Usage: `archive search <text>`."""
+
+    title = 'Archive'
+
+    command = 'archive'
+
+    async def _run(self):
+        words = [getattr(argument, 'bare_word', None) for argument in self._arguments]
+        if not words or words[0] != 'search' or None in words[1:]:
+            raise ValueError('Usage: archive search <text>')
+        text = ' '.join(word.strip('"') for word in words[1:])
+        self._status_line_tokens = [self._token('Archive search: ' + text)]
+
+        lines = []
+        for record in self._tosh.tasks.archive.search(text):
+            lines.append([self._token(record['lines'][0], Token.Task.Archived)])
+            lines += [[self._token('  ' + line)] for line in record['lines'][1:] if text.lower() in line.lower()]
+        self._output_token_lines = lines or [[self._token('No archived tasks found')]]
+
+    @staticmethod
+    def completions():
+        return ['search']
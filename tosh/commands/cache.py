@@ -0,0 +1,40 @@
+"""Command to inspect and clear result caches."""
+from ..cache import ResultCache
+from ..command import Command
+
+
+class CacheCommand(Command):
+    """Shows statistics of the result caches, or clears them. Usage: `cache stats` or `cache clear [name]`."""
+
+    title = 'Cache'
+
+    command = 'cache'
+
+    async def _run(self):
+        words = [getattr(argument, 'bare_word', '').strip('"') for argument in self._arguments]
+        if words[:1] == ['stats']:
+            self._set_output_text(self._stats())
+        elif words[:1] == ['clear']:
+            caches = [cache for cache in ResultCache.all if len(words) == 1 or cache.name in words[1:]]
+            for cache in caches:
+                cache.clear()
+            self._set_output_text('Cleared {} cache(s)'.format(len(caches)))
+        else:
+            raise ValueError('Usage: cache stats | cache clear [name...]')
+
+    @staticmethod
+    def _stats():
+        if not ResultCache.all:
+            return 'No caches'
+        stats = [cache.stats() for cache in ResultCache.all]
+        width = max(len('Cache'), max(len(s.name) for s in stats))
+        row = '{:<' + str(width) + '} {:>8} {:>8} {:>12} {:>8}'
+        lines = [row.format('Cache', 'Hits', 'Misses', 'Entries', 'TTL')]
+        for s in stats:
+            lines.append(row.format(s.name, s.hits, s.misses, '{}/{}'.format(s.entries, s.max_entries),
+                                    '{}s'.format(s.ttl)))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def completions():
+        return ['stats', 'clear']
@@ -0,0 +1,96 @@
+"""Command to run a command for every item of a list."""
+from ..command import Command
+from ..tasks import Task
+from ..variable import Variable
+from ..vars.basic import List
+
+
+class EachCommand(Command):
+    """
+    Runs a command for every item of a list. Usage: `each list command [arguments]`, with `_` standing for the item.
+
+    e.g: `each users reset_password _` runs `reset_password` for every user. Items run concurrently, at most
+    `tasks: max_parallel` (config) at a time. Returns a list of the results of the items that succeeded, so it is not
+    aligned with the items if any failed: failures are reported in the output, with their errors and how many results
+    were left out.
+    """
+
+    title = 'Each'
+
+    command = 'each'
+
+    PLACEHOLDER = '_'
+
+    @classmethod
+    def plan_return_type(cls, arguments):
+        """A list of the return type of the command, if any."""
+        command = arguments[1] if len(arguments) > 1 else None
+        if not (isinstance(command, type) and issubclass(command, Command)) or not command.return_type:
+            return None
+        return [command.return_type]
+
+    async def _run(self):
+        if len(self._arguments) < 2 or not isinstance(self._arguments[1], type):
+            raise ValueError('Usage: each list command [arguments], using _ for the item')
+        items = await (await self.sub(self._arguments[0])).items()
+        command_class = self._arguments[1]
+
+        # Arguments other than the item are evaluated once for all the items
+        template = []
+        for argument in self._arguments[2:]:
+            if isinstance(argument, Task):
+                argument = _ValueTask(self._tosh, await self.sub(argument), argument.bare_word)
+            template.append(argument)
+
+        commands = [(_item_command, (command_class, self._item_arguments(template, item)), {}) for item in items]
+        self._show_progress(command_class, 0, len(items))
+        results = [None] * len(items)
+        done = 0
+        # Cancelled (e.g: timed out), the items still running or waiting are cancelled too
+        async with self.parallel_stream(commands, limit=self._max_parallel()) as stream:
+            async for index, result in stream:
+                results[index] = result
+                done += 1
+                self._show_progress(command_class, done, len(items))
+
+        failures = ['Item {}: {}'.format(index, str(result) or type(result).__name__)
+                    for index, result in enumerate(results) if isinstance(result, BaseException)]
+        if failures:
+            failures.append('{} of {} items failed, left out of the result'.format(len(failures), len(items)))
+            self._set_output_text('\n'.join(failures))
+        if command_class.return_type:
+            values = [result for result in results if not isinstance(result, BaseException)]
+            return List(Variable[command_class.return_type], values)
+
+    def _item_arguments(self, template, item):
+        arguments = []
+        for argument in template:
+            if getattr(argument, 'bare_word', None) == self.PLACEHOLDER and not isinstance(argument, Task):
+                argument = _ValueTask(self._tosh, item, self.PLACEHOLDER)
+            elif isinstance(argument, _ValueTask):
+                # Tasks can only run once, each command gets its own
+                argument = _ValueTask(self._tosh, argument.value, argument.bare_word)
+            arguments.append(argument)
+        return arguments
+
+    def _show_progress(self, command_class, done, total):
+        self._status_line_tokens = [self._token('Each {}: {}/{}'.format(command_class.command, done, total))]
+
+
+def _item_command(command_class, arguments, _tosh):
+    return command_class(_tosh, arguments)
+
+
+class _ValueTask(Task):
+    """Task returning an already evaluated variable, to pass it as an argument."""
+
+    def __init__(self, tosh, value, bare_word):
+        super().__init__(tosh)
+        self.value = value
+        self.bare_word = bare_word
+        self.return_type = value.type()
+        self._status_line_tokens = [self._token('{} ({})'.format(bare_word, self.return_type.class_name))]
+
+    async def run(self):
+        self._status = Task.Status.Success
+        return self.value
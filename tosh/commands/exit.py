@@ -11,5 +11,7 @@ class ExitCommand(Command):
 
     command = 'exit'
 
+    barrier = True
+
     async def _run(self):
-        self._tosh._cli.exit()
+        self._tosh.exit()
@@ -0,0 +1,96 @@
+"""Command to find where the time of a statement goes."""
+import re
+
+from ..command import Command
+from ..tasks import format_duration
+
+
+class ProfileCommand(Command):
+    """
+    Runs a statement again and shows its timings. Usage: `profile "statement"`, `profile command [arguments]`, or just
+    `profile` for the last one. The statement is the text written after `profile`, keeping its quoting.
+
+    Shows the critical path (the chain of subtasks finishing last, which determine the total time) and the count, p50,
+    p95 and total duration of tasks aggregated by title.
+    """
+
+    title = 'Profile'
+
+    command = 'profile'
+
+    async def _run(self):
+        cmdline = self._profiled_cmdline()
+        self._status_line_tokens = [self._token('Profile: ' + cmdline)]
+        statement = self._tosh._parser.parse(cmdline)
+        if statement is None:
+            raise ValueError('Could not parse statement: ' + cmdline)
+        statement.set_cmdline(cmdline)
+        await self.sub(statement)
+
+        lines = ['Critical path:'] + self._critical_path(statement) + ['', 'By task:'] + self._by_title(statement)
+        self._set_output_text('\n'.join(lines))
+
+    def _profiled_cmdline(self):
+        if self._arguments:
+            return self._text_after_command()
+        for task in reversed(self._tosh.tasks._tasks):
+            cmdline = getattr(task, 'cmdline', None)
+            if cmdline and task.finished and not cmdline.startswith(self.command):
+                return cmdline
+        raise ValueError('No statement to profile')
+
+    def _text_after_command(self):
+        """Return the text following the command in the command line of its statement, unquoted if a string."""
+        statement = self._parent
+        while statement is not None and getattr(statement, 'cmdline', None) is None:
+            statement = statement._parent
+        match = re.search(r'\b{}\s+(.*)'.format(self.command), statement.cmdline, re.S) if statement else None
+        if match is None:
+            # Not run from a statement, the text of the arguments is all there is
+            return ' '.join(argument.bare_word.strip('"') for argument in self._arguments)
+        text = match.group(1).strip()
+        if len(text) > 1 and text[0] == text[-1] == '"' and '"' not in text[1:-1]:
+            text = text[1:-1]
+        return text
+
+    @staticmethod
+    def _critical_path(statement):
+        lines = []
+        task, depth = statement, 0
+        while task is not None:
+            timing = '{:>8} {:>8}'.format('+' + format_duration(task._started - statement._started),
+                                          format_duration(task.duration))
+            notes = []
+            if task.wait_time >= 0.001 and task is not statement:
+                notes.append('waited {} to start'.format(format_duration(task.wait_time)))
+            if task.lock_wait >= 0.001:
+                notes.append('waited {} for locks'.format(format_duration(task.lock_wait)))
+            notes = ' ({})'.format(', '.join(notes)) if notes else ''
+            lines.append('{} {}{}{}'.format(timing, '  ' * depth, task.profile_title, notes))
+
+            finished = [child for child in task._children if child._ended is not None and child._started is not None]
+            task = max(finished, key=lambda child: child._ended) if finished else None
+            depth += 1
+        return lines
+
+    @staticmethod
+    def _by_title(statement):
+        durations = {}
+        for _, task in statement.walk():
+            if task.duration is not None:
+                durations.setdefault(task.profile_title, []).append(task.duration)
+
+        width = max(len(title) for title in durations)
+        row = '{:<' + str(width) + '} {:>6} {:>8} {:>8} {:>8}'
+        lines = [row.format('Task', 'Count', 'p50', 'p95', 'Total')]
+        by_total = sorted(durations.items(), key=lambda item: sum(item[1]), reverse=True)
+        for title, times in by_total:
+            times.sort()
+            lines.append(row.format(title, len(times), format_duration(_percentile(times, 0.5)),
+                                    format_duration(_percentile(times, 0.95)), format_duration(sum(times))))
+        return lines
+
+
+def _percentile(sorted_values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
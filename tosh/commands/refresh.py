@@ -0,0 +1,17 @@
+"""Command to forget cached attributes of a variable."""
+from ..command import Command
+
+
+class RefreshCommand(Command):
+    """Forgets cached attributes of a variable, so they are loaded again. Usage: `refresh variable [attribute...]`."""
+
+    title = 'Refresh'
+
+    command = 'refresh'
+
+    async def _run(self):
+        words = [getattr(argument, 'bare_word', None) for argument in self._arguments]
+        if not words or words[0] not in self._tosh.variables or None in words:
+            raise ValueError('Usage: refresh variable [attribute...]')
+        forgotten = self._tosh.variables[words[0]].forget_attributes(*words[1:])
+        self._set_output_text('Forgot {} cached attribute(s) of {}'.format(forgotten, words[0]))
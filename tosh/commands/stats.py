@@ -0,0 +1,28 @@
+"""Command to show internal statistics, to diagnose performance."""
+from ..command import Command
+from ..lib import ssh
+
+
+class StatsCommand(Command):
+    """Shows redraw, cache, SSH connection and session pool statistics."""
+
+    title = 'Statistics'
+
+    command = 'stats'
+
+    async def _run(self):
+        lines = []
+        redraw = getattr(self._tosh, 'redraw', None)
+        if redraw:
+            lines.append('Redraws: {} requested, {} drawn'.format(redraw.requested, redraw.drawn))
+        cache = self._tosh._parser.cache_info()
+        lines.append('Parser cache: {} hits, {} misses, {}/{} command lines'.format(
+            cache.hits, cache.misses, cache.currsize, cache.maxsize))
+        for connection in ssh.connection_stats():
+            lines.append('Connection to {}: {}, {} reconnects{}'.format(
+                connection.hostname, 'connected' if connection.connected else 'reconnecting', connection.reconnects,
+                ', last error: {}'.format(connection.last_error) if connection.last_error else ''))
+        for pool in ssh.pool_stats():
+            lines.append('Sessions {} at {}: {} in use, {} idle (max {}), {} waiting'.format(
+                pool.handler, pool.hostname, pool.in_use, pool.idle, pool.max_sessions, pool.waiters))
+        self._set_output_text('\n'.join(lines))
@@ -62,7 +62,7 @@ class CommandLineCompleter(Completer):
                 yield i
         else:
             # Multiple tokens, try to do something smart
-            if tokens[-1].type == '=':
+            if tokens[-1].type in ('=', 'LAZY_ASSIGN'):
                 # After an equal, return expressions
                 for i in self._add_space(self._expressions(True), fix):
                     yield i
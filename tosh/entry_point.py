@@ -1,18 +1,46 @@
 """Carto.sh entry point and argument parsing."""
 import argparse
 import appdirs
+import itertools
 import os
 import sys
 
-from .tosh import Tosh
 from .config import Config
+from .startup_profile import StartupProfile
+
 
 def run():
+    profile = StartupProfile()
     parser = argparse.ArgumentParser(prog="carto.sh")
     parser.add_argument("-c", "--config", default=appdirs.user_config_dir('tosh') + "/config.yml", type=open, help="path to alternative config.yml")
+    parser.add_argument("-e", "--execute", action="append", default=[], metavar="STATEMENT",
+                        help="run a statement without UI (can be repeated)")
+    parser.add_argument("-f", "--file", type=argparse.FileType('r'),
+                        help="run the statements in a script without UI ('-' for stdin)")
+    parser.add_argument("-o", "--output", choices=['text', 'json'], default='text',
+                        help="output format without UI: task trees or JSON lines")
+    parser.add_argument("-j", "--jobs", type=int, default=8,
+                        help="maximum number of statements running at once without UI")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print how long each phase of startup took on exit (interactive shell only)")
     args = parser.parse_args(sys.argv[1:])
 
     data_dir = appdirs.user_data_dir('tosh')
     os.makedirs(data_dir, exist_ok=True)
 
-    Tosh(data_dir, Config(args.config)).run()
+    with profile.phase('config load'):
+        config = Config(args.config)
+
+    if args.execute or args.file or not sys.stdin.isatty():
+        if args.profile_startup:
+            parser.error('--profile-startup only applies to the interactive shell')
+        from .headless import HeadlessTosh
+        lines = itertools.chain(args.execute, args.file or ([] if args.execute else sys.stdin))
+        tosh = HeadlessTosh(data_dir, config, sys.stdout, output_format=args.output, jobs=args.jobs)
+        sys.exit(tosh.run(lines))
+
+    profile.import_modules('prompt_toolkit', 'ply.yacc', 'tosh.tosh')
+    from .tosh import Tosh
+    Tosh(data_dir, config, profile).run()
+    if args.profile_startup:
+        print(profile.report(), file=sys.stderr)
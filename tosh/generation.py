@@ -0,0 +1,20 @@
+"""
+Generation counter for everything that changes how a command line is lexed.
+
+Whether a word is a command, a variable or a bare word, and what a literal loads, depends on the registered commands,
+the registered variable classes and the variables of the session. Any change to them bumps the generation, so
+anything cached from lexing or parsing a command line can be discarded when the generation changes.
+"""
+
+_generation = 0
+
+
+def current():
+    """Return the current generation."""
+    return _generation
+
+
+def bump():
+    """Start a new generation, called whenever commands, variable classes or session variables change."""
+    global _generation
+    _generation += 1
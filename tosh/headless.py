@@ -0,0 +1,199 @@
+"""
+Headless execution of statements, for scripts and batch jobs.
+
+Statements go through the same parser and tasks as in the interactive shell, but nothing is rendered: the resulting
+task trees are written to an output stream as plain text or JSON lines, in the same order as the statements.
+"""
+import asyncio
+from collections import ChainMap
+from importlib import import_module
+import json
+import traceback
+
+from .archive import TaskArchive
+from .command import Command
+from .parser import CommandLineLexer, CommandLineParser
+from .statements import Statement, ErrorStatement
+from .tasks import Task, TaskManager
+from .variable import Variable, VariableStore
+
+# Marks a statement assigning a variable that can't be known before running the previous statements
+_UNKNOWN = object()
+
+
+class _TextStyle:
+    """
+    The templates of a style (see `tosh.ui.style.ToshStyle`), which is all rendering as text needs.
+
+    Only the style definitions are imported, so headless runs don't load the UI.
+    """
+
+    def __init__(self, name):
+        """Load the templates of a style by name, on top of the default style."""
+        try:
+            module = import_module('tosh.ui.styles.' + name)
+        except ImportError:
+            raise NameError('Style not found: ' + name)
+        self._templates = ChainMap(module.templates, import_module('tosh.ui.styles.default').templates)
+
+    def get_template(self, template_name, mouse_handler=None, **kwargs):
+        """Return the tokens of a template, applying the kwargs. Nothing is clicked, mouse handlers are left out."""
+        return [(style, text.format(**kwargs)) for style, text in self._templates[template_name]]
+
+
+class HeadlessTosh:
+    """
+    Run statements without UI, with the same interface as `Tosh` for commands and tasks.
+
+    Statements are pipelined: each one starts as soon as the statements it depends on have finished. A statement
+    depends on previous statements assigning a variable it reads, and on previous statements reading or assigning the
+    variable it assigns. Parsing is delayed until then too, as the lexer needs to know which words are variables.
+    """
+
+    def __init__(self, base_dir, config, output, output_format='text', jobs=8):
+        """
+        Initialize the session.
+
+        :param output: stream to write results to.
+        :param output_format: 'text' for task trees as in the UI, 'json' for one JSON document per statement.
+        :param jobs: maximum number of statements running (or finished but not yet written) at the same time.
+        """
+        for module in config.get('modules') or []:
+            import_module(module)
+
+        self.config = config
+        self.variables = VariableStore()
+        self.style = _TextStyle(config.get('ui', 'style') or 'default')
+        # Tasks are not kept, but the archive of the interactive shell can be searched
+        self.tasks = TaskManager(self, archive=TaskArchive(base_dir + '/archive.jsonl'))
+        self._parser = CommandLineParser(self, base_dir)
+        self._lexer = CommandLineLexer(self, classify=True)
+        self._output = output
+        self._output_format = output_format
+        self._jobs = jobs
+        self._exit = False
+        self._failed = False
+
+        # Last statement assigning each variable, statements reading it since then, and last statement whose
+        # assigned variable was unknown, which every later statement waits for.
+        self._writers = {}
+        self._readers = {}
+        self._barrier = None
+
+    def refresh(self, immediate=False):
+        """Nothing to redraw without UI."""
+        pass
+
+    def exit(self):
+        """Stop running statements, used by the `exit` command."""
+        self._exit = True
+
+    def run(self, lines):
+        """Run statements from an iterable of lines. Return the exit status: 1 if any statement failed, else 0."""
+        asyncio.get_event_loop().run_until_complete(self._run(lines))
+        return 1 if self._failed else 0
+
+    async def _run(self, lines):
+        loop = asyncio.get_event_loop()
+        lines = iter(lines)
+        pending = asyncio.Queue(maxsize=self._jobs)
+        writer = asyncio.ensure_future(self._write_results(pending))
+
+        for cmdline in self.config.get('autostart') or []:
+            await pending.put(self._schedule(cmdline))
+
+        while not self._exit:
+            # Read in a thread, lines may come slowly from stdin
+            line = await loop.run_in_executor(None, next, lines, None)
+            if line is None:
+                break
+            cmdline = line.strip()
+            if cmdline and not cmdline.startswith('#'):
+                await pending.put(self._schedule(cmdline))
+
+        await pending.put(None)
+        await writer
+
+    async def _write_results(self, pending):
+        while True:
+            future = await pending.get()
+            if future is None:
+                return
+            statement = await future
+            if statement is None:
+                continue
+            if statement._status is not Task.Status.Success:
+                self._failed = True
+            if self._output_format == 'json':
+                self._output.write(json.dumps(statement.as_dict()) + '\n')
+            else:
+                self._output.write('\n'.join(statement.text_lines()) + '\n')
+            self._output.flush()
+
+    def _schedule(self, cmdline):
+        """Start running a statement once its dependencies finish. Return a future for the statement."""
+        reads, assigns = self._variables_used(cmdline)
+
+        dependencies = [self._barrier] if self._barrier else []
+        dependencies += [self._writers[name] for name in reads if name in self._writers]
+        if assigns is _UNKNOWN:
+            dependencies += self._writers.values()
+            dependencies += [future for readers in self._readers.values() for future in readers]
+        elif assigns is not None:
+            dependencies += [self._writers[assigns]] if assigns in self._writers else []
+            dependencies += self._readers.get(assigns, [])
+        dependencies = [future for future in dependencies if not future.done()]
+
+        future = asyncio.ensure_future(self._run_statement(cmdline, dependencies))
+        for name in reads:
+            self._readers[name] = [f for f in self._readers.get(name, []) if not f.done()] + [future]
+        if assigns is _UNKNOWN:
+            # Everything else waits for this statement, which waits for everything before it
+            self._barrier = future
+            self._writers = {}
+            self._readers = {}
+        elif assigns is not None:
+            self._writers[assigns] = future
+            self._readers[assigns] = []
+        return future
+
+    def _variables_used(self, cmdline):
+        """
+        Return the names a command line may read, and the variable it assigns.
+
+        The assigned variable is None if the statement assigns nothing, or _UNKNOWN if the variable can't be known
+        before running the previous statements (e.g: `x.attribute` assigns a variable named after its type).
+        """
+        try:
+            self._lexer.lexer.input(cmdline)
+            tokens = list(self._lexer.lexer)
+        except Exception:
+            # The statement will fail to parse, it can run right away
+            return set(), None
+
+        words = [t for t in tokens if t.type in ('BARE_WORD', 'VARIABLE')]
+        if len(tokens) > 2 and tokens[1].type in ('=', 'LAZY_ASSIGN') and tokens[0].type in ('BARE_WORD', 'VARIABLE'):
+            return {t.value for t in words[1:]}, tokens[0].value
+        reads = {t.value for t in words}
+        if tokens and tokens[0].type == 'COMMAND':
+            command = Command[tokens[0].value]
+            if command.barrier or command.plan_return_type.__func__ is not Command.plan_return_type.__func__:
+                # The assigned variable depends on the type of the arguments
+                return reads, _UNKNOWN
+            return reads, Variable[command.return_type].default_var_name if command.return_type else None
+        return reads, _UNKNOWN
+
+    async def _run_statement(self, cmdline, dependencies):
+        if dependencies:
+            await asyncio.wait(dependencies)
+        if self._exit:
+            return None
+        try:
+            statement = self._parser.parse(cmdline)
+            if not isinstance(statement, Statement):
+                return ErrorStatement(self, cmdline, "Parser returned no task")
+            statement.set_cmdline(cmdline)
+            await statement.run()
+            return statement
+        except BaseException:
+            return ErrorStatement(self, cmdline, traceback.format_exc())
@@ -5,23 +5,34 @@ Support multiple sessions per server, including batch console sessions and inter
 """
 
 import asyncio
+from collections import deque, namedtuple
 import functools
 import json
 import re
-
-import asyncssh
+import time
 
 from tosh.tasks import task
 
 _connections = {}
 _connections_locks = {}
 
+# Prompts are looked for in the lines completed by each chunk of output plus up to this many characters before it
+_PROMPT_WINDOW = 256
+
+PoolStats = namedtuple('PoolStats', ['hostname', 'handler', 'in_use', 'idle', 'waiters', 'max_sessions'])
+ConnectionStats = namedtuple('ConnectionStats', ['hostname', 'connected', 'reconnects', 'last_error'])
+
 
 @task('Connecting to {pos[0]}')
 async def get_connection(hostname, *, task):
-    """Return a connection to the given server, creating it if no previous connection exists."""
-    lock = _connections_locks.get(hostname, asyncio.Lock())
-    with (await lock):
+    """
+    Return a connection to the given server, creating it if no previous connection exists.
+
+    Concurrent first calls for a server share a single connection. If the connection was lost, wait for it to
+    reconnect (see `_SSHConnection`).
+    """
+    lock = _connections_locks.setdefault(hostname, asyncio.Lock())
+    async with task.locked(lock):
         if hostname not in _connections:
             parts = hostname.split(':')
             if len(parts) > 2:
@@ -32,7 +43,9 @@ async def get_connection(hostname, *, task):
                 conn = _SSHConnection(task._tosh, hostname)
             await conn.connect()
             _connections[hostname] = conn
-    return _connections[hostname]
+    conn = _connections[hostname]
+    await conn.wait_connected()
+    return conn
 
 
 class _SSHConnection:
@@ -41,52 +54,373 @@ class _SSHConnection:
 
     Can contain multiple sessions, normally one for running carto.sh command
     and an interactive one to connect directly to the UI for user use.
+
+    Once connected, the connection is watched: it is probed every `ssh: health_interval` seconds (running `true`, 60
+    by default, 0 or null to not probe, e.g: if the host doesn't allow running commands), and if it closes or a probe
+    fails or takes longer than `ssh: health_timeout`, it reconnects, waiting between attempts from 1 second up to
+    `ssh: reconnect_max_delay`. Pooled console sessions lost with the connection are opened again once reconnected.
+    Interactive sessions are not. If it can't reconnect within `ssh: reconnect_timeout` seconds, it gives up: whoever
+    is waiting for it fails with the last error, and the next `get_connection` opens a new connection.
     """
 
     def __init__(self, tosh, hostname, port=22):
         self._tosh = tosh
-        self._lock = asyncio.Lock()
         self._hostname = hostname
         self._port = port
         self.connection = None
         self._sessions = []
+        self._pools = {}
+        self._ready = asyncio.get_event_loop().create_future()
+        self._monitor = None
+        self.reconnects = 0
+        self.last_error = None
 
     async def connect(self):
         """Connect to the server, get_connection from this module automatically calls this."""
+        config = self._tosh.config
         options = {
-            'username':    self._tosh.config.get('ssh', 'username'),
+            'username':    config.get('ssh', 'username'),
             'port':        self._port,
             'known_hosts': None
         }
-        client_keys = self._tosh.config.get('ssh', 'client_keys')
+        client_keys = config.get('ssh', 'client_keys')
         if client_keys is not None:
             options['client_keys'] = client_keys
 
+        import asyncssh
         self.connection = await asyncssh.connect(self._hostname, **options)
-
-    @task("Opening session with {pos[1].__name__} at {pos[0]._hostname}")
+        self._ready.set_result(None)
+        if self._monitor is None:
+            self._monitor = asyncio.ensure_future(self._watch())
+
+    async def wait_connected(self):
+        """Wait until connected, e.g: while reconnecting. Raise `ConnectionError` if it gave up reconnecting."""
+        await asyncio.shield(self._ready)
+
+    @property
+    def connected(self):
+        return self._ready.done() and self._ready.exception() is None
+
+    async def _watch(self):
+        config = self._tosh.config
+        # Unlike other options, a null interval is not the default
+        interval = (config.get('ssh') or {}).get('health_interval', 60)
+        while True:
+            await self._wait_until_unhealthy(interval, config.get('ssh', 'health_timeout') or 10)
+            self._ready = asyncio.get_event_loop().create_future()
+            self.connection.close()
+            if not await self._reconnect(config.get('ssh', 'reconnect_max_delay') or 60,
+                                         config.get('ssh', 'reconnect_timeout') or 300):
+                return
+
+    async def _wait_until_unhealthy(self, interval, timeout):
+        closed = asyncio.ensure_future(self.connection.wait_closed())
+        try:
+            if not interval:
+                await closed
+            while not closed.done():
+                await asyncio.wait([closed], timeout=interval)
+                if not closed.done() and not await self._probe(timeout):
+                    return
+        finally:
+            closed.cancel()
+
+    async def _probe(self, timeout):
+        try:
+            await asyncio.wait_for(self.connection.run('true'), timeout)
+            return True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.last_error = e
+            return False
+
+    async def _reconnect(self, max_delay, timeout):
+        """Reconnect, returning whether it did before `timeout`. If not, fail the waiting callers and forget it."""
+        deadline = time.monotonic() + timeout
+        delay = 1
+        while True:
+            try:
+                await self.connect()
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = e
+            if time.monotonic() + delay > deadline:
+                self._ready.set_exception(ConnectionError(
+                    'Could not reconnect to {}: {}'.format(self._hostname, self.last_error)))
+                # Mark the exception as retrieved, nobody may be waiting
+                self._ready.exception()
+                for hostname, connection in list(_connections.items()):
+                    if connection is self:
+                        del _connections[hostname]
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+        self.reconnects += 1
+        for pool in self._pools.values():
+            pool.restore()
+        return True
+
+    def stats(self):
+        """Return the statistics of this connection."""
+        return ConnectionStats(self._hostname, self.connected, self.reconnects, self.last_error)
+
+    @task("Getting session with {pos[1].__name__} at {pos[0]._hostname}")
     async def get_session(self, session_class, **args):
-        """Return a switchable session using the specified handler."""
+        """
+        Return a switchable session using the specified handler, checked out of its pool for exclusive use. It goes
+        back to the pool when leaving its context manager, e.g:
+
+            session = await task.sub(connection.get_session, SSHRailsHandler, command_key='rails')
+            async with session as handler:
+                users = await handler.get_object('User.count')
+
+        Prefer `checkout`, unless the session is needed itself, e.g: to switch its handler.
+        """
         task = args.pop('task')
-        with (await self._lock):
-            try:
-                return next(filter(lambda s: isinstance(s._handler, session_class), self._sessions))
-            except StopIteration:
-                new_session = await session_class.create_session(self, task._tosh, **args)
-                self._sessions.append(new_session)
-                return new_session
-
-    def remove_session(self, session):
-        """Remove a session from this connection."""
+        pool = self.pool(session_class, **args)
+        session = await pool.acquire(task)
+        session._pool = pool
+        return session
+
+    def pool(self, session_class, **args):
+        """Return the pool of sessions with a handler class, created with the given arguments."""
+        key = (session_class, tuple(sorted(args.items())))
+        if key not in self._pools:
+            config = self._tosh.config
+            self._pools[key] = _SessionPool(self, session_class, args,
+                                            min_sessions=config.get('ssh', 'pool', 'min') or 0,
+                                            max_sessions=config.get('ssh', 'pool', 'max') or 4,
+                                            idle_timeout=config.get('ssh', 'pool', 'idle_timeout') or 300)
+        return self._pools[key]
+
+    def checkout(self, session_class, task=None, **args):
+        """
+        Return an async context manager with exclusive use of the handler of a pooled session, e.g:
+
+            async with connection.checkout(SSHRailsHandler, task, command_key='rails') as handler:
+                users = await handler.get_object('User.count')
+
+        Sessions are opened as needed, up to the configured maximum (`ssh: pool: max`). Then, callers wait in order
+        of arrival for a session to be returned. If a task is given, time waiting is added to its `lock_wait`.
+        """
+        return _Checkout(self.pool(session_class, **args), task)
+
+    def pool_stats(self):
+        """Return the statistics of the session pools of this connection."""
+        return [pool.stats() for pool in self._pools.values()]
+
+    def remove_session(self, session, lost=False):
+        """Remove a session from this connection. If `lost` (closed by an error), its pool opens it again later."""
         if session in self._sessions:
             self._sessions.remove(session)
+        for pool in self._pools.values():
+            pool.discard(session, lost or not self.connected)
 
     def add_session(self, session):
         """Add a session to this connection."""
         self._sessions.append(session)
 
 
-class _SSHSwitchableSession(asyncssh.SSHClientSession):
+class _SessionPool:
+    """
+    Sessions with the same handler class and creation arguments on a connection, for exclusive use (see `checkout`).
+
+    Returned sessions are handed directly to the oldest waiter, so nobody arriving later can take them first. Idle
+    sessions over `min_sessions` are closed after `idle_timeout` seconds.
+    """
+
+    def __init__(self, connection, session_class, args, min_sessions=0, max_sessions=4, idle_timeout=300):
+        """Create an empty pool. Sessions are opened on demand."""
+        self._connection = connection
+        self._session_class = session_class
+        self._args = args
+        self.min_sessions = min_sessions
+        self.max_sessions = max(max_sessions, 1)
+        self.idle_timeout = idle_timeout
+        self._sessions = []
+        self._idle = deque()  # (session, time it was returned), most recently returned last
+        self._waiters = deque()
+        self._opening = 0
+        self._lost = 0
+        self._trim_handle = None
+
+    def stats(self):
+        """Return the statistics of this pool."""
+        waiters = sum(1 for waiter in self._waiters if not waiter.done())
+        return PoolStats(self._connection._hostname, self._session_class.__name__,
+                         len(self._sessions) - len(self._idle), len(self._idle), waiters, self.max_sessions)
+
+    async def acquire(self, task=None):
+        """Return a session for exclusive use, opening one or waiting for one if needed. Call `release` after."""
+        start = time.monotonic()
+        # Once woken up without a session, go ahead of the other waiters: it was this caller's turn
+        woken = False
+        try:
+            while True:
+                if self._idle and (woken or not self._waiters):
+                    session = self._idle.pop()[0]
+                    if getattr(session._handler, 'closed', False):
+                        self.discard(session)
+                        continue
+                    return session
+                if len(self._sessions) + self._opening < self.max_sessions and (woken or not self._waiters):
+                    return await self._open(task)
+                session = await self._wait()
+                if session is not None:
+                    return session
+                # None: a session was closed or failed to open, there is room to open another one
+                woken = True
+        finally:
+            if task is not None:
+                task.lock_wait += time.monotonic() - start
+
+    def release(self, session):
+        """Return a session to the pool, giving it to the oldest waiter if any."""
+        if session not in self._sessions:
+            # Closed or switched to another handler while in use
+            self._wake_up(None)
+        elif getattr(session._handler, 'closed', False):
+            self.discard(session)
+        elif not self._wake_up(session):
+            self._idle.append((session, time.monotonic()))
+            self._schedule_trim()
+
+    def discard(self, session, lost=False):
+        """Forget a session, e.g: when closed. Its place can be taken by a new one. If `lost`, see `restore`."""
+        if session in self._sessions:
+            self._sessions.remove(session)
+            self._idle = deque(entry for entry in self._idle if entry[0] is not session)
+            if lost:
+                self._lost += 1
+            self._wake_up(None)
+
+    async def prewarm(self, count, task=None):
+        """Open sessions until there are `count` of them, and keep that many open even when idle."""
+        self.min_sessions = max(self.min_sessions, min(count, self.max_sessions))
+        missing = self.min_sessions - len(self._sessions) - self._opening
+        results = await asyncio.gather(*[self._open(task) for _ in range(missing)], return_exceptions=True)
+        # Sessions opened are in the pool as in use, even if others failed
+        errors = [result for result in results if isinstance(result, BaseException)]
+        for session in results:
+            if not isinstance(session, BaseException):
+                self.release(session)
+        if errors:
+            raise errors[0]
+
+    def restore(self):
+        """Open sessions again in the background, as many as were lost (e.g: with the connection) or `min_sessions`."""
+        count = min(max(self._lost, self.min_sessions - len(self._sessions)), self.max_sessions - len(self._sessions))
+        self._lost = 0
+        for _ in range(count):
+            asyncio.ensure_future(self._open_idle())
+
+    async def _open_idle(self):
+        try:
+            session = await self._open(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._connection.last_error = e
+        else:
+            self.release(session)
+
+    async def _open(self, task):
+        self._opening += 1
+        try:
+            session = await self._open_session(task)
+        except BaseException:
+            self._wake_up(None)
+            raise
+        finally:
+            self._opening -= 1
+        self._sessions.append(session)
+        self._connection._sessions.append(session)
+        return session
+
+    async def _open_session(self, task):
+        await self._connection.wait_connected()
+        if task is not None:
+            return await task.sub(_open_pooled_session, self._connection, self._session_class, self._args)
+        return await _open_pooled_session(self._connection, self._session_class, self._args)
+
+    async def _wait(self):
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            # Given a session right before being cancelled, pass it on
+            if waiter.done() and not waiter.cancelled():
+                if waiter.result() is not None:
+                    self.release(waiter.result())
+                else:
+                    self._wake_up(None)
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _wake_up(self, session):
+        """Give a session (or a chance to open one, if None) to the oldest waiter. Return False if nobody waits."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(session)
+                return True
+        return False
+
+    def _schedule_trim(self):
+        if self._trim_handle is None and self.idle_timeout:
+            self._trim_handle = asyncio.get_event_loop().call_later(self.idle_timeout, self._trim)
+
+    def _trim(self):
+        self._trim_handle = None
+        now = time.monotonic()
+        # Oldest first, keeping at least `min_sessions` open
+        while self._idle and len(self._sessions) > self.min_sessions and now - self._idle[0][1] >= self.idle_timeout:
+            session, _ = self._idle.popleft()
+            self._sessions.remove(session)
+            session.close()
+        if self._idle:
+            self._schedule_trim()
+
+
+@task("Opening session with {pos[1].__name__} at {pos[0]._hostname}")
+async def _open_pooled_session(connection, session_class, args, *, task):
+    return await session_class.create_session(connection, connection._tosh, **args)
+
+
+class _Checkout:
+    """Async context manager for a session checked out of a pool, see `_SSHConnection.checkout`."""
+
+    def __init__(self, pool, task):
+        self._pool = pool
+        self._task = task
+        self._session = None
+
+    async def __aenter__(self):
+        self._session = await self._pool.acquire(self._task)
+        return self._session._handler
+
+    async def __aexit__(self, *_):
+        self._pool.release(self._session)
+        self._session = None
+
+
+def pool_stats():
+    """Return the statistics of all session pools, of all connections."""
+    return [stats for connection in _connections.values() for stats in connection.pool_stats()]
+
+
+def connection_stats():
+    """Return the statistics of all connections."""
+    return [connection.stats() for connection in _connections.values()]
+
+
+class _SSHSwitchableSession:
     """
     A class representing a single SSH session, which delegates its work to a handler.
 
@@ -99,7 +433,10 @@ class _SSHSwitchableSession(asyncssh.SSHClientSession):
         with (await session) as handler:
             handler.do_something()
 
-    This enforces that the handler is only accessed from a context manager, ensuring its correct release.
+    This enforces that the handler is only accessed from a context manager, ensuring its correct release. Sessions
+    checked out with `_SSHConnection.get_session` go back to their pool when leaving the context manager.
+
+    Instances are created from `_switchable_session_class()`, which adds the `asyncssh.SSHClientSession` base class.
     """
 
     def __init__(self, connection, initial_handler):
@@ -107,6 +444,7 @@ class _SSHSwitchableSession(asyncssh.SSHClientSession):
         self._connection = connection
         self._handler = initial_handler(self)
         self._lock = asyncio.Lock()
+        self._pool = None
 
     def switch_handler(self, new_handler):
         """
@@ -123,11 +461,16 @@ class _SSHSwitchableSession(asyncssh.SSHClientSession):
     def connection_made(self, chan):
         self.channel = chan
 
+    def close(self):
+        """Close the channel of this session, which removes it from the connection once closed."""
+        if self.channel is not None:
+            self.channel.close()
+
     def data_received(self, data, datatype):
         self._handler.data_received(data, datatype)
 
     def connection_lost(self, exc):
-        self._connection.remove_session(self)
+        self._connection.remove_session(self, lost=exc is not None)
         self._handler.connection_lost(exc)
 
     @task('Adquiring lock for SSH session')
@@ -142,6 +485,7 @@ class _SSHSwitchableSession(asyncssh.SSHClientSession):
 
     def __exit__(self, *_):
         self._lock.release()
+        self._check_in()
 
     async def __aenter__(self):
         await self._lock.acquire()
@@ -149,6 +493,23 @@ class _SSHSwitchableSession(asyncssh.SSHClientSession):
 
     async def __aexit__(self, *_):
         self._lock.release()
+        self._check_in()
+
+    def _check_in(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.release(self)
+
+
+@functools.lru_cache()
+def _switchable_session_class():
+    """
+    Return the session class for asyncssh, which must inherit from `asyncssh.SSHClientSession`.
+
+    The base class is added on first use, so asyncssh is only imported when the first connection is made.
+    """
+    import asyncssh
+    return type('_SSHSwitchableSession', (_SSHSwitchableSession, asyncssh.SSHClientSession), {})
 
 
 class _SSHHandler:
@@ -158,9 +519,17 @@ class _SSHHandler:
     def write(self, data):
         return self._session.channel.write(data)
 
+    def pause_reading(self):
+        """Stop receiving data from the session until `resume_reading`, so the server waits (back-pressure)."""
+        self._session.channel.pause_reading()
+
+    def resume_reading(self):
+        """Receive data from the session again."""
+        self._session.channel.resume_reading()
+
     @classmethod
     async def _create_switchable_session(cls, connection, **kwargs):
-        switchable_constructor = functools.partial(_SSHSwitchableSession, connection, cls)
+        switchable_constructor = functools.partial(_switchable_session_class(), connection, cls)
         _, switchable = await connection.connection.create_session(switchable_constructor, **kwargs)
         return switchable
 
@@ -177,6 +546,43 @@ class _SSHInteractiveHandler(_SSHHandler):
         self._tab.close()
 
 
+class _OutputBuffer:
+    """
+    Output of a command, kept as a list of chunks so appending costs amortized linear time for any output size.
+
+    Only the offsets of the first and last line breaks are tracked, which is all that is needed to strip the echoed
+    command and the prompt (see `text`).
+    """
+
+    def __init__(self):
+        """Create an empty buffer."""
+        self.clear()
+
+    def clear(self):
+        """Remove all the output."""
+        self._chunks = []
+        self._size = 0
+        self._first_newline = None
+        self._last_newline = None
+
+    def append(self, data):
+        """Add a chunk of output."""
+        last = data.rfind('\n')
+        if last >= 0:
+            if self._first_newline is None:
+                self._first_newline = self._size + data.find('\n')
+            self._last_newline = self._size + last
+        self._chunks.append(data)
+        self._size += len(data)
+
+    def text(self):
+        """Return the output without its first line (the command) and last line (the prompt)."""
+        if self._first_newline is None or self._first_newline == self._last_newline:
+            return ''
+        output = ''.join(self._chunks)
+        return output[self._first_newline + 1:self._last_newline]
+
+
 class SSHConsoleHandler(_SSHHandler):
     _PROMPT_MATCHER = None
 
@@ -186,10 +592,12 @@ class SSHConsoleHandler(_SSHHandler):
     def __init__(self, session):
         super().__init__(session)
         self._lock = asyncio.Lock()
-        self._line_buffer = ''
+        self._line_tail = ''
         self._at_prompt = False
         self._waiter = None
-        self._out_buffer = ''
+        self._output = _OutputBuffer()
+        self._stream = None
+        self._lost = None
 
     @classmethod
     async def create_session(cls, connection, tosh):
@@ -200,7 +608,14 @@ class SSHConsoleHandler(_SSHHandler):
         await switchable._handler._wait_for_prompt()
         return switchable
 
+    @property
+    def closed(self):
+        """Whether the session was closed, see `connection_lost`."""
+        return self._lost is not None
+
     async def _wait_for_prompt(self):
+        if self._lost is not None:
+            raise ConnectionError(self._lost)
         if not self._at_prompt:
             try:
                 self._waiter = asyncio.Future()
@@ -209,46 +624,232 @@ class SSHConsoleHandler(_SSHHandler):
             finally:
                 self._waiter = None
 
-    async def run_command(self, command):
-        with (await self._lock):
+    async def run_command(self, command, task=None):
+        """Run a command and return its output. If a task is given, time waiting for the session is added to it."""
+        async with (task.locked(self._lock) if task else self._lock):
             # Wait for prompt and reset buffers
             await self._wait_for_prompt()
-            self._out_buffer = ''
-            self._line_buffer = ''
+            self._output.clear()
+            self._line_tail = ''
 
             # Run the command and wait for results
             self.write(command + '\n')
             self._at_prompt = False
-            await self._wait_for_prompt()
+            try:
+                await self._wait_for_prompt()
+            except asyncio.CancelledError:
+                # Interrupt the command, so the next one finds the prompt. The lock is released on exit.
+                self.write('\x03')
+                raise
 
             # Remove the command (first line) and prompt (last line) from the results
-            return '\n'.join(self._out_buffer.split('\n')[1:-1])
+            return self._output.text()
+
+    def stream_command(self, command, task=None, max_lines=1000):
+        """
+        Run a command, returning a `CommandStream` async iterator over the lines of its output as they arrive. e.g:
+
+            async with handler.stream_command('SELECT * FROM users;') as lines:
+                async for line in lines:
+                    ...
+
+        Lines are stripped like with `run_command`. Reading from the session pauses while more than `max_lines` lines
+        are waiting to be read. Leaving the `async with` block before the end interrupts the command.
+        """
+        return CommandStream(self, command, task, max_lines)
+
+    def stream_list(self, tosh, command, task=None, window=1000):
+        """
+        Run a command, returning a `StreamingList` of `String`s with the lines of its output, filled in as they arrive
+        (see `stream_command`). Stopping the list (e.g: assigning its variable again) interrupts the command.
+        """
+        from tosh.vars.basic import StreamingList, String
+        return StreamingList(tosh, String, self.stream_command(command, task, window), window,
+                             make_item=functools.partial(String, tosh))
 
     def data_received(self, data, _: 'datatype'):
         """
         Called by asyncssh when data is received.
 
-        Adds the data to the command result buffer. Parses last line to look for the prompt if any.
+        Adds the data to the command result buffer, or passes it to the command stream if any. Looks for the prompt in
+        the lines completed by this data and the current partial line, only scanning the end of the partial line
+        received before (prompts must be shorter than `_PROMPT_WINDOW`), so long lines arriving in many chunks are not
+        scanned again and again.
         """
-        self._out_buffer += data
-        self._line_buffer += data
-        lines = self._line_buffer.split('\n')
-        self._line_buffer = lines[-1]
-
-        if self._waiter:
-            for l in lines:
-                if self._PROMPT_MATCHER.search(l):
-                    self._waiter.set_result(None)
-                    break
+        lines = (self._line_tail + data).split('\n')
+        self._line_tail = lines[-1][-_PROMPT_WINDOW:]
+        at_prompt = any(self._PROMPT_MATCHER.search(l) for l in lines)
+        if self._stream is not None:
+            self._stream._feed(data, at_prompt)
+        else:
+            self._output.append(data)
+
+        # Look for the prompt even if nobody is waiting, e.g: after an interrupted command
+        if at_prompt:
+            self._at_prompt = True
+            if self._waiter and not self._waiter.done():
+                self._waiter.set_result(None)
 
     def connection_lost(self, exc):
-        """Called when the connection is closed."""
-        pass
+        """Called when the session is closed. Fails the command running, if any, and any command run later."""
+        self._lost = 'Session closed' + (': {}'.format(exc) if exc else '')
+        if self._waiter and not self._waiter.done():
+            self._waiter.set_exception(ConnectionError(self._lost))
+        if self._stream is not None:
+            self._stream._fail(ConnectionError(self._lost))
+
+
+class CommandStream:
+    """
+    Lines of the output of a command run in a console session, as they arrive. See `SSHConsoleHandler.stream_command`.
+
+    Must be used in an `async with` block, which runs the command and keeps the session locked until the block is
+    left, interrupting the command and waiting for the prompt if it is still running. Iterating over the lines
+    outside of the block raises `RuntimeError`, so a loop leaving early can't leave the session locked. The lines
+    can feed a `StreamingList` (see `SSHConsoleHandler.stream_list`), e.g: to show rows while a query runs.
+    """
+
+    def __init__(self, handler, command, task=None, max_lines=1000):
+        """Create a stream for a command, which is run when entering the `async with` block."""
+        self._handler = handler
+        self._command = command
+        self._task = task
+        self._max_lines = max_lines
+        self._lines = deque()
+        self._partial = []
+        self._echo_skipped = False
+        self._paused = False
+        self._started = False
+        self._locked = None
+        self._finished = False
+        self._closed = False
+        self._error = None
+        self._waiter = None
+
+    async def __aenter__(self):
+        await self._start()
+        return self
+
+    async def __aexit__(self, *_):
+        await self.aclose()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._started:
+            raise RuntimeError('Command streams must be used in an "async with" block')
+        while not self._lines:
+            if self._finished or self._closed:
+                await self.aclose()
+                if self._error is not None:
+                    raise self._error
+                raise StopAsyncIteration
+            self._waiter = asyncio.get_event_loop().create_future()
+            await self._waiter
+        line = self._lines.popleft()
+        if self._paused and len(self._lines) <= self._max_lines // 2:
+            self._paused = False
+            self._handler.resume_reading()
+        return line
+
+    async def _start(self):
+        if self._started:
+            return
+        self._started = True
+        lock = self._handler._lock
+        self._locked = self._task.locked(lock) if self._task is not None else lock
+        await self._locked.__aenter__()
+        try:
+            await self._handler._wait_for_prompt()
+            self._handler._line_tail = ''
+            self._handler._stream = self
+            self._handler.write(self._command + '\n')
+            self._handler._at_prompt = False
+        except BaseException:
+            self._handler._stream = None
+            self._closed = True
+            await self._locked.__aexit__(None, None, None)
+            raise
+
+    def _fail(self, error):
+        """Stop the stream with an error (e.g: the session was closed), raised once the lines received are read."""
+        self._error = error
+        self._finished = True
+        self._handler._stream = None
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _feed(self, data, at_prompt):
+        parts = data.split('\n')
+        self._partial.append(parts[0])
+        if len(parts) > 1:
+            lines = [''.join(self._partial)] + parts[1:-1]
+            self._partial = [parts[-1]]
+            if not self._echo_skipped:
+                # The first line is the command
+                self._echo_skipped = True
+                lines = lines[1:]
+            self._lines.extend(lines)
+        if at_prompt:
+            # The last (partial) line is the prompt
+            self._finished = True
+            self._partial = []
+            self._handler._stream = None
+        elif len(self._lines) > self._max_lines and not self._paused:
+            self._paused = True
+            self._handler.pause_reading()
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def aclose(self):
+        """Stop reading lines. If the command is still running, interrupt it and wait for the prompt."""
+        if self._closed or not self._started:
+            self._closed = True
+            return
+        self._closed = True
+        handler = self._handler
+        try:
+            if not self._finished:
+                handler._stream = None
+                handler.write('\x03')
+                if self._paused:
+                    handler.resume_reading()
+                await handler._wait_for_prompt()
+        finally:
+            handler._stream = None
+            self._lines.clear()
+            await self._locked.__aexit__(None, None, None)
+
+
+def _ruby_string(text):
+    """
+    Return a Ruby string literal for a text.
+
+    JSON strings are valid Ruby double quoted strings, once `#` is escaped so nothing is interpolated. Non ASCII
+    characters are kept as is, as Ruby can't parse JSON surrogate pairs.
+    """
+    return json.dumps(text, ensure_ascii=False).replace('#', '\\#')
 
 
 class SSHRailsHandler(SSHConsoleHandler):
+    """
+    Rails console session.
+
+    `get_object` calls made in the same event loop iteration are sent together, as a single command line evaluating
+    all the expressions (up to `_MAX_BATCH`), so they pay a single round trip. Each result is tagged with the index of
+    its expression. Each expression is evaluated from a string literal in its own `begin ... rescue`, so errors
+    (including syntax errors) only fail their own call. A batch is interrupted once all its callers are cancelled.
+    """
+
     _PROMPT_MATCHER = re.compile(r'irb\(main\):\d+:0> ')
     _OUTPUT_MARKER = 'to.sh>'
+    _ERROR_MARKER = 'to.sh!'
+    _MAX_BATCH = 50
+
+    def __init__(self, session):
+        super().__init__(session)
+        self._batch = []
 
     @classmethod
     async def create_session(cls, connection, tosh, command_key):
@@ -268,19 +869,78 @@ class SSHRailsHandler(SSHConsoleHandler):
         """
         Run a command and returns the parsed response as a dictionary.
 
-        This wraps the command, ading `to_json` in order to parse it easily.
+        This wraps the command, ading `to_json` in order to parse it easily. The command is batched with the other
+        calls made at the same time.
         """
-        wrapped_command = "puts '{}' + ({}).to_json".format(self._OUTPUT_MARKER, command)
-        result = await self.run_command(wrapped_command)
+        return await self._submit(command, task)
+
+    @task('Running Rails commands in batch')
+    async def get_objects(self, commands, *, task):
+        """Run several commands in as few round trips as possible. Return their results (or exceptions)."""
+        return await asyncio.gather(*[self._submit(command, task) for command in commands], return_exceptions=True)
+
+    def _submit(self, command, task):
+        future = asyncio.get_event_loop().create_future()
+        if not self._batch:
+            asyncio.get_event_loop().call_soon(self._send_batch)
+        self._batch.append((command, future, task))
+        return future
+
+    def _send_batch(self):
+        batch, self._batch = self._batch, []
+        for start in range(0, len(batch), self._MAX_BATCH):
+            chunk = batch[start:start + self._MAX_BATCH]
+            runner = asyncio.ensure_future(self._run_batch(chunk))
+            for _, future, _ in chunk:
+                future.add_done_callback(functools.partial(self._cancel_if_abandoned, chunk, runner))
+
+    @staticmethod
+    def _cancel_if_abandoned(batch, runner, _):
+        """Cancel a running batch once all its callers are cancelled, which interrupts it (see `run_command`)."""
+        if all(future.cancelled() for _, future, _ in batch):
+            runner.cancel()
+
+    async def _run_batch(self, batch):
+        # Leave out commands cancelled while waiting to be sent
+        batch = [(command, future, task) for command, future, task in batch if not future.done()]
+        if not batch:
+            return
+        expressions = ["begin; puts '{}{} ' + eval({}).to_json; rescue Exception => e; "
+                       "puts '{}{} ' + (e.class.name + ': ' + e.message).to_json; end; ".format(
+                           self._OUTPUT_MARKER, tag, _ruby_string(command), self._ERROR_MARKER, tag)
+                       for tag, (command, _, _) in enumerate(batch)]
         try:
-            line = next(l[len(self._OUTPUT_MARKER):] for l in result.split('\n') if l.startswith(self._OUTPUT_MARKER))
-            return json.loads(line)
-        except StopIteration:
-            raise RuntimeError("Command returned no results: " + result)
+            # Time waiting for the session is added to the first task
+            result = await self.run_command(''.join(expressions) + 'nil', batch[0][2])
+        except BaseException as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        results = {}
+        for line in result.split('\n'):
+            for marker in (self._OUTPUT_MARKER, self._ERROR_MARKER):
+                if line.startswith(marker):
+                    tag, _, payload = line[len(marker):].partition(' ')
+                    results[int(tag)] = (marker, payload)
+        for tag, (_, future, _) in enumerate(batch):
+            if future.done():
+                continue
+            try:
+                if tag not in results:
+                    raise RuntimeError("Command returned no results: " + result)
+                marker, payload = results[tag]
+                if marker == self._ERROR_MARKER:
+                    raise RuntimeError(json.loads(payload))
+                future.set_result(json.loads(payload))
+            except Exception as e:
+                future.set_exception(e)
 
 
 class SSHPsqlHandler(SSHConsoleHandler):
-    _PROMPT_MATCHER = re.compile(r'\S+=# ')
+    # Finds the same lines as r'\S+=# ' with `search`, without backtracking over long words (quadratic)
+    _PROMPT_MATCHER = re.compile(r'\S=# ')
 
     async def set_read_only(self):
         """Set the database to read-only (just in case)."""
@@ -306,3 +966,11 @@ class SSHPsqlHandler(SSHConsoleHandler):
         if 'FATAL' in result:
             raise RuntimeError("Database does not exist: " + result)
         await self.set_read_only()
+
+
+# Handler classes by name, for the `prewarm` config section
+HANDLERS = {
+    'console': SSHConsoleHandler,
+    'rails':   SSHRailsHandler,
+    'psql':    SSHPsqlHandler
+}
@@ -1,12 +1,19 @@
 """Lexer/parser for command line."""
+from collections import OrderedDict, namedtuple
+import hashlib
+import importlib.util
+import os
+
 from ply import lex, yacc
 from prompt_toolkit.layout.lexers import Lexer
 from prompt_toolkit.token import Token
 
+from . import generation
 from .command import Command
-from .variable import Variable, GetVariableTask, AttributeAccessTask
+from .variable import Variable
 from .vars import String, Integer
-from .statements import CommandStatement, AssignmentStatement
+from .plan import (LoadPlan, GetVariablePlan, AttributePlan, MapAttributePlan, CommandPlan, AssignmentPlan,
+                   LazyAssignmentPlan, CommandStatementPlan)
 
 
 class BareWord:
@@ -27,9 +34,14 @@ class BareWord:
 
 
 class CommandLineLexer(Lexer):
-    """Lexer for the command line. See PLY dcos for details on the syntax."""
-    tokens = ('BARE_WORD', 'VARIABLE', 'COMMAND', 'LITERAL', 'STRING', 'INTEGER')
-    literals = ('=', '.', '(', ')')
+    """
+    Lexer for the command line. See PLY dcos for details on the syntax.
+
+    By default, token values are plans (see `tosh.plan`) used by the parser. A lexer created with `classify=True` only
+    classifies tokens, without building any plan or resolving literals (e.g: the type of links), for highlighting.
+    """
+    tokens = ('BARE_WORD', 'VARIABLE', 'COMMAND', 'LITERAL', 'STRING', 'INTEGER', 'LAZY_ASSIGN')
+    literals = ('=', '.', '(', ')', '*')
     TOKEN_MAP = {
         'BARE_WORD': Token.Lexer.BareWord,
         'VARIABLE':  Token.Lexer.Variable,
@@ -37,18 +49,62 @@ class CommandLineLexer(Lexer):
         'LITERAL':   Token.Lexer.Literal,
         'STRING':    Token.Lexer.String,
         'INTEGER':   Token.Lexer.Integer,
+        'LAZY_ASSIGN': Token.Lexer.Assign,
         '=':         Token.Lexer.Assign,
         '.':         Token.Lexer.Access,
         '(':         Token.Lexer.StartSubCommand,
-        ')':         Token.Lexer.EndSubCommand
+        ')':         Token.Lexer.EndSubCommand,
+        '*':         Token.Lexer.Access
     }
 
     t_ignore = " \t"
+    t_LAZY_ASSIGN = r':='
 
-    def __init__(self, tosh):
-        """Initialize the lexer."""
+    # Master PLY lexer, built once by `load_tables` and cloned by every instance
+    _master_lexer = None
+
+    # Highlighting tokens by (command line, show_errors, classify), shared by all instances
+    _LINE_CACHE_SIZE = 512
+    _line_cache = OrderedDict()
+    _line_cache_generation = None
+
+    def __init__(self, tosh, classify=False):
+        """Initialize the lexer, cloning the shared master lexer (building it first if needed)."""
+        if CommandLineLexer._master_lexer is None:
+            CommandLineLexer.load_tables()
         self._tosh = tosh
-        self.lexer = lex.lex(module=self)
+        self._classify = classify
+        self.lexer = CommandLineLexer._master_lexer.clone(self)
+        # PLY's clone rebinds the rules of every state but not the current one, reset it
+        self.lexer.begin('INITIAL')
+
+    @classmethod
+    def load_tables(cls, tabdir=None):
+        """
+        Build the master lexer shared by all instances.
+
+        If `tabdir` is given, the lexer tables are read from a lextab module in that directory, or generated and
+        written there if it does not exist yet. The name of the module includes a signature of the lexing rules,
+        so tables from other versions are never used.
+        """
+        rules = cls.__new__(cls)
+        rules._tosh = None
+        if tabdir is None:
+            CommandLineLexer._master_lexer = lex.lex(module=rules)
+            return
+
+        tabname = 'lextab_' + cls._signature()
+        lextab = _load_tabmodule(tabname, os.path.join(tabdir, tabname + '.py'))
+        CommandLineLexer._master_lexer = lex.lex(module=rules, optimize=True, lextab=lextab or tabname,
+                                                 outputdir=tabdir)
+
+    @classmethod
+    def _signature(cls):
+        """Return a hash of the lexing rules, to detect outdated lextab modules."""
+        rules = [(name, getattr(cls, name) if isinstance(getattr(cls, name), str) else getattr(cls, name).__doc__)
+                 for name in sorted(dir(cls)) if name.startswith('t_')]
+        description = repr((cls.tokens, cls.literals, cls.t_ignore, rules))
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()[:12]
 
     def lex_document(self, cli, document):
         """Called from prompt_toolkit for command line highlighting."""
@@ -62,8 +118,26 @@ class CommandLineLexer(Lexer):
         """
         Return the tokens for the given line.
 
-        Uses the subyacent PLY lexer for parsing the line and maps lexer tokens to prompt toolkit tokens.
+        Results are cached until the lexing generation changes (see `tosh.generation`).
         """
+        cache = CommandLineLexer._line_cache
+        if CommandLineLexer._line_cache_generation != generation.current():
+            cache.clear()
+            CommandLineLexer._line_cache_generation = generation.current()
+
+        key = (cmdline, show_errors, self._classify)
+        tokens = cache.get(key)
+        if tokens is None:
+            tokens = tuple(self._lex_cmdline(cmdline, show_errors))
+            cache[key] = tokens
+            if len(cache) > CommandLineLexer._LINE_CACHE_SIZE:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+        return list(tokens)
+
+    def _lex_cmdline(self, cmdline, show_errors):
+        """Uses the subyacent PLY lexer for parsing the line and maps lexer tokens to prompt toolkit tokens."""
 
         def _get_text(t):
             try:
@@ -88,12 +162,17 @@ class CommandLineLexer(Lexer):
         except IndexError:
             return []
 
+    @staticmethod
+    def _load_plan(varclass, argument):
+        return LoadPlan(varclass, argument, Variable[varclass.load_type(argument)])
+
     def t_LITERAL(self, t):
         r'\w+".*?"'
         (prefix, value, _) = t.value.split('"')
         try:
             varclass = Variable.by_prefix[prefix]
-            t.value = varclass.load_task(self._tosh, value)
+            if not self._classify:
+                t.value = self._load_plan(varclass, value)
             return t
         except KeyError:
             raise KeyError("Unknown literal prefix {0}".format(prefix))
@@ -101,54 +180,111 @@ class CommandLineLexer(Lexer):
     def t_LINK(self, t):
         r'[a-z]+://[-\w/?&=%.#:]*'
         t.type = 'LITERAL'
-        t.value = Variable["Link"].load_task(self._tosh, t.value)
+        if not self._classify:
+            t.value = self._load_plan(Variable["Link"], t.value)
         return t
 
     def t_STRING(self, t):
         r'".*?"'
         if t.value.strip('"').startswith('http'):
             t.type = 'LITERAL'
-            t.value = Variable["Link"].load_task(self._tosh, t.value.strip('"'))
-        else:
-            t.value = String.load_task(self._tosh, t.value)
+            if not self._classify:
+                t.value = self._load_plan(Variable["Link"], t.value.strip('"'))
+        elif not self._classify:
+            t.value = self._load_plan(String, t.value)
         return t
 
     def t_BARE_WORD(self, t):
         r'[^\W\d]\w*'
         if t.value in Command.all_commands:
             t.type = 'COMMAND'
-            t.value = Command[t.value]
+            if not self._classify:
+                t.value = Command[t.value]
         elif t.value in self._tosh.variables:
             t.type = 'VARIABLE'
-            t.value = GetVariableTask(self._tosh, t.value)
+            if not self._classify:
+                t.value = GetVariablePlan(t.value, self._tosh.variables[t.value].type())
         else:
             t.type = 'BARE_WORD'
-            t.value = BareWord(t.value)
+            if not self._classify:
+                t.value = BareWord(t.value)
 
         return t
 
     def t_INTEGER(self, t):
         r'\d+'
-        t.value = Integer.load_task(self._tosh, t.value)
+        if not self._classify:
+            t.value = self._load_plan(Integer, t.value)
         return t
 
     def t_error(self, t):
         raise SyntaxError("Illegal character '%s'" % t.value[0])
 
 
+def _load_tabmodule(name, path):
+    """Load a lextab module generated by PLY from a path. Return None if missing or from another PLY version."""
+    try:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except Exception:
+        return None
+    if getattr(module, '_tabversion', None) != lex.__tabversion__:
+        return None
+    return module
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
 class CommandLineParser:
-    """Syntax parser for the command line. See PLY docs for details."""
+    """
+    Syntax parser for the command line. See PLY docs for details.
 
-    def __init__(self, tosh, base_dir):
-        """Initialize the syntax parser."""
+    The grammar rules build plans (see `tosh.plan`), which are cached per command line, so parsing a command line
+    again only needs to build new tasks from its plan. The cache is discarded whenever the lexing generation changes
+    (see `tosh.generation`), as the same command line may then be lexed differently.
+    """
+
+    def __init__(self, tosh, base_dir, cache_size=256):
+        """Initialize the syntax parser, with a plan cache for up to `cache_size` command lines."""
         self._tosh = tosh
+        CommandLineLexer.load_tables(base_dir)
         self._lexer = CommandLineLexer(tosh)
         self.tokens = self._lexer.tokens  # parser needs lexing tokens
-        self._parser = yacc.yacc(module=self, picklefile=base_dir + '/parser.pickle')
+        self._parser = yacc.yacc(module=self, picklefile=base_dir + '/parser.pickle', debug=False)
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_generation = generation.current()
+        self._hits = 0
+        self._misses = 0
 
     def parse(self, commandline):
-        """Parse a command line."""
-        return self._parser.parse(commandline, lexer=self._lexer.lexer)
+        """Parse a command line, returning a new statement for it."""
+        if self._cache_generation != generation.current():
+            self._cache.clear()
+            self._cache_generation = generation.current()
+
+        plan = self._cache.get(commandline)
+        if plan is not None:
+            self._hits += 1
+            self._cache.move_to_end(commandline)
+            return plan.build(self._tosh)
+
+        self._misses += 1
+        plan = self._parser.parse(commandline, lexer=self._lexer.lexer)
+        if plan is None:
+            return None
+        # Build before caching, so plans failing to build are not cached
+        statement = plan.build(self._tosh)
+        self._cache[commandline] = plan
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return statement
+
+    def cache_info(self):
+        """Return statistics of the plan cache, like `functools.lru_cache`."""
+        return CacheInfo(self._hits, self._misses, self._cache_size, len(self._cache))
 
     def p_assignment_statement(self, t):
         """
@@ -157,29 +293,38 @@ class CommandLineParser:
                   | BARE_WORD '=' expression
                   | BARE_WORD '=' command
         """
-        t[0] = AssignmentStatement(self._tosh, t[1].bare_word, t[3])
+        t[0] = AssignmentPlan(t[1].bare_word, t[3])
+
+    def p_lazy_assignment_statement(self, t):
+        """
+        statement : VARIABLE LAZY_ASSIGN expression
+                  | VARIABLE LAZY_ASSIGN command
+                  | BARE_WORD LAZY_ASSIGN expression
+                  | BARE_WORD LAZY_ASSIGN command
+        """
+        t[0] = LazyAssignmentPlan(t[1].bare_word, t[3])
 
     def p_autoassignment_statement(self, t):
         """
         statement : expression
         """
-        t[0] = AssignmentStatement(self._tosh, Variable[t[1].return_type].default_var_name, t[1])
+        t[0] = AssignmentPlan(Variable[t[1].return_type].default_var_name, t[1])
 
     def p_command_statement(self, t):
         "statement : command"
         return_type = t[1].return_type
         if return_type:
-            t[0] = AssignmentStatement(self._tosh, Variable[t[1].return_type].default_var_name, t[1])
+            t[0] = AssignmentPlan(Variable[t[1].return_type].default_var_name, t[1])
         else:
-            t[0] = CommandStatement(self._tosh, t[1])
+            t[0] = CommandStatementPlan(t[1])
 
     def p_command(self, t):
         "command : COMMAND params"
-        t[0] = t[1](self._tosh, t[2])
+        t[0] = CommandPlan(t[1], tuple(t[2]), False)
 
     def p_bare_command(self, t):
         "command : COMMAND"
-        t[0] = t[1](self._tosh, [])
+        t[0] = CommandPlan(t[1], (), False)
 
     def p_params(self, t):
         "params : params param"
@@ -200,12 +345,15 @@ class CommandLineParser:
 
     def p_expression_access(self, t):
         "expression : expression '.' name"
-        t[0] = AttributeAccessTask(self._tosh, t[1], t[3].bare_word)
+        t[0] = AttributePlan(t[1], t[3].bare_word)
+
+    def p_expression_map_access(self, t):
+        "expression : expression '.' '*' '.' name"
+        t[0] = MapAttributePlan(t[1], t[5].bare_word)
 
     def p_expression_subcommand(self, t):
         "expression : '(' command ')'"
-        t[2]._cmdline = '(' + str(t[2]) + ')'
-        t[0] = t[2]
+        t[0] = t[2]._replace(subcommand=True)
 
     # Expression has priority over name (bare word)
     def p_param(self, t):
@@ -226,6 +374,6 @@ class CommandLineParser:
 
     def p_error(self, t):
         if t:
-            raise SyntaxError("Syntax error at '%s'" % t.value)
+            raise SyntaxError("Syntax error at '%s'" % getattr(t.value, 'bare_word', t.value))
         else:
             raise SyntaxError("Syntax error")
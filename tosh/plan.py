@@ -0,0 +1,139 @@
+"""
+Plans: immutable descriptions of the tasks resulting from parsing a command line.
+
+The parser produces a plan instead of the tasks themselves, so the plan for a command line can be cached and
+turned into fresh tasks each time the command line is run (tasks keep their state, so they can only run once).
+"""
+from collections import namedtuple
+
+from .statements import AssignmentStatement, LazyAssignmentStatement, CommandStatement
+from .variable import Variable, GetVariableTask, AttributeAccessTask, MapAttributeTask
+
+
+class Plan:
+    """Base class for plans. Subclasses implement `build`, returning a new task."""
+
+    __slots__ = ()
+
+    def build(self, tosh):
+        """Return a new task following this plan."""
+        raise NotImplementedError()
+
+
+def build(value, tosh):
+    """Build a value that may be a plan, returning other values (bare words, command classes) unchanged."""
+    if isinstance(value, Plan):
+        return value.build(tosh)
+    return value
+
+
+class LoadPlan(Plan, namedtuple('LoadPlan', ['variable_class', 'argument', 'return_type'])):
+    """Load a variable from a literal, e.g: u"username"."""
+
+    __slots__ = ()
+
+    @property
+    def bare_word(self):
+        """What the user wrote for this literal."""
+        return self.argument
+
+    def build(self, tosh):
+        """Return a task loading the variable."""
+        return self.variable_class.load_task(tosh, self.argument)
+
+
+class GetVariablePlan(Plan, namedtuple('GetVariablePlan', ['varname', 'return_type'])):
+    """Get a variable from the session."""
+
+    __slots__ = ()
+
+    @property
+    def bare_word(self):
+        """What the user wrote for this variable."""
+        return self.varname
+
+    def build(self, tosh):
+        """Return a task getting the variable."""
+        return GetVariableTask(tosh, self.varname)
+
+
+class AttributePlan(Plan, namedtuple('AttributePlan', ['base', 'attr_name'])):
+    """Access the attribute of the variable returned by another plan."""
+
+    __slots__ = ()
+
+    @property
+    def return_type(self):
+        """Type of the attribute, raises KeyError if the base variable has no such attribute."""
+        base_type = Variable[self.base.return_type]
+        return Variable[base_type.attributes[self.attr_name][0]]
+
+    def build(self, tosh):
+        """Return a task accessing the attribute."""
+        return AttributeAccessTask(tosh, self.base.build(tosh), self.attr_name)
+
+
+class MapAttributePlan(Plan, namedtuple('MapAttributePlan', ['base', 'attr_name'])):
+    """Access an attribute of every item of the list returned by another plan, e.g: `users.*.email`."""
+
+    __slots__ = ()
+
+    @property
+    def return_type(self):
+        """List of the type of the attribute, raises KeyError if the items have no such attribute."""
+        item_type = Variable[self.base.return_type]._item_class
+        return Variable[[item_type.attributes[self.attr_name][0]]]
+
+    def build(self, tosh):
+        """Return a task accessing the attribute of every item."""
+        return MapAttributeTask(tosh, self.base.build(tosh), self.attr_name)
+
+
+class CommandPlan(Plan, namedtuple('CommandPlan', ['command_class', 'arguments', 'subcommand'])):
+    """Run a command, with a tuple of arguments (plans, bare words or command classes)."""
+
+    __slots__ = ()
+
+    @property
+    def return_type(self):
+        """Return type of the command, which may depend on its arguments."""
+        return self.command_class.plan_return_type(self.arguments)
+
+    def build(self, tosh):
+        """Return a task running the command."""
+        command = self.command_class(tosh, [build(argument, tosh) for argument in self.arguments])
+        # The type of some commands depends on their arguments
+        command.return_type = self.return_type
+        if self.subcommand:
+            command._cmdline = '(' + str(command) + ')'
+        return command
+
+
+class AssignmentPlan(Plan, namedtuple('AssignmentPlan', ['varname', 'expression'])):
+    """Statement assigning the result of an expression to a variable."""
+
+    __slots__ = ()
+
+    def build(self, tosh):
+        """Return the statement."""
+        return AssignmentStatement(tosh, self.varname, self.expression.build(tosh))
+
+
+class LazyAssignmentPlan(Plan, namedtuple('LazyAssignmentPlan', ['varname', 'expression'])):
+    """Statement assigning an expression to a variable, to be evaluated on first use."""
+
+    __slots__ = ()
+
+    def build(self, tosh):
+        """Return the statement. The expression is kept as a plan, its tasks are built when evaluated."""
+        return LazyAssignmentStatement(tosh, self.varname, self.expression)
+
+
+class CommandStatementPlan(Plan, namedtuple('CommandStatementPlan', ['command'])):
+    """Statement running a command that returns nothing."""
+
+    __slots__ = ()
+
+    def build(self, tosh):
+        """Return the statement."""
+        return CommandStatement(tosh, self.command.build(tosh))
@@ -0,0 +1,45 @@
+"""Startup time profiling, see the `--profile-startup` option."""
+from contextlib import contextmanager
+from importlib import import_module
+import time
+
+
+class StartupProfile:
+    """Record the time spent in each phase of startup, and the time until the first prompt is shown."""
+
+    def __init__(self):
+        """Start measuring."""
+        self._start = time.perf_counter()
+        self._phases = []
+        self._first_prompt = None
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager measuring a phase of startup."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phases.append((name, time.perf_counter() - start))
+
+    def import_modules(self, *names):
+        """Import modules measuring each one. Only the first import of a module takes time."""
+        for name in names:
+            with self.phase('import ' + name):
+                import_module(name)
+
+    def first_prompt(self, *_):
+        """Record that the first prompt has been shown. Can be used as a prompt_toolkit render event handler."""
+        if self._first_prompt is None:
+            self._first_prompt = time.perf_counter() - self._start
+
+    def report(self):
+        """Return the report of the startup times, as text."""
+        lines = ['Startup profile:']
+        for name, duration in self._phases:
+            lines.append('  {:<32} {:>8.1f} ms'.format(name, duration * 1000))
+        if self._first_prompt is not None:
+            other = self._first_prompt - sum(duration for _, duration in self._phases)
+            lines.append('  {:<32} {:>8.1f} ms'.format('other (event loop, first render)', other * 1000))
+            lines.append('  {:<32} {:>8.1f} ms'.format('time to first prompt', self._first_prompt * 1000))
+        return '\n'.join(lines)
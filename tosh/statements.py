@@ -1,32 +1,58 @@
 import asyncio
 import traceback
 
-from .tasks import Task
+from .tasks import Task, task
 from .command import CommandFailedException
+from .lib import ssh
 
 class Statement(Task):
     def __init__(self, tosh):
-        from .parser import CommandLineLexer
         super().__init__(tosh)
         self._output = []
-        self._lexer = CommandLineLexer(self._tosh)
+        self._future = None
+        self.cmdline = None
 
     def set_cmdline(self, cmdline):
-        self._status_line_tokens = self._lexer.lex_cmdline(cmdline, show_errors=False)
+        self.cmdline = cmdline
+        from .parser import CommandLineLexer
+        self._status_line_tokens = CommandLineLexer(self._tosh, classify=True).lex_cmdline(cmdline, show_errors=False)
+
+    def cancel(self):
+        """Cancel this statement and all its subtasks, if running."""
+        if self._future is not None:
+            self._future.cancel()
+
+    def _timeout(self):
+        """Return the deadline for this statement in seconds, from its command or the configuration."""
+        timeout = getattr(getattr(self, '_task', None), 'timeout', None)
+        if timeout is None and self._tosh.config is not None:
+            timeout = self._tosh.config.get('tasks', 'timeout')
+        return timeout
 
     async def run(self):
         self._status = Task.Status.Running
         self._tosh.refresh()
+        timeout = self._timeout()
         try:
-            result = await self._run()
+            self._future = asyncio.ensure_future(self._run())
+            result = await asyncio.wait_for(self._future, timeout)
             self._status = Task.Status.Success
             return result
+        except asyncio.CancelledError:
+            self._status = Task.Status.Cancelled
+        except asyncio.TimeoutError:
+            self._status = Task.Status.Error
+            if self._future.cancelled():
+                self._set_output_text('Timed out after {} seconds'.format(timeout))
+            else:
+                self._set_output_text(traceback.format_exc())
         except CommandFailedException:
             self._status = Task.Status.Error
         except BaseException as e:
             self._status = Task.Status.Error
             self._set_output_text(traceback.format_exc())
         finally:
+            self._future = None
             self._tosh.refresh()
 
 class CommandStatement(Statement):
@@ -51,6 +77,34 @@ class AssignmentStatement(Statement):
         result.var_name = self._varname
         out_line = [self._token("{} = ".format(self._varname))] + result.tokens()
         self._output_token_lines = [out_line]
+        if hasattr(result, 'add_listener'):
+            self._follow_stream(result, out_line)
+
+    def _follow_stream(self, streaming, out_line):
+        """Keep the output up to date while a streaming list (see `StreamingList`) gets new items."""
+        def _items_arrived(index):
+            if index is not None:
+                # Modified in place, only the new item is rendered
+                out_line.extend(streaming.item_tokens(index))
+            progress = streaming.progress_tokens()
+            self._output_token_lines = [out_line] + ([progress] if progress else [])
+            self._tosh.refresh()
+        streaming.add_listener(_items_arrived)
+        _items_arrived(None)
+
+class LazyAssignmentStatement(Statement):
+    def __init__(self, tosh, variable, plan):
+        super().__init__(tosh)
+        self._plan = plan
+        self._varname = variable
+
+    async def _run(self):
+        from .variable import LazyVariable
+        if not self._plan.return_type:
+            raise AttributeError("Right hand side expression does not returns a variable")
+        variable = LazyVariable(self._tosh, self._plan)
+        self._tosh.variables[self._varname] = variable
+        self._output_token_lines = [[self._token("{} := ".format(self._varname))] + variable.tokens()]
 
 class ErrorStatement(Statement):
     def __init__(self, tosh, cmdline, error):
@@ -58,3 +112,70 @@ class ErrorStatement(Statement):
         self._set_output_text(error)
         self._status = Task.Status.Error
         self.set_cmdline(cmdline)
+
+
+class PrewarmStatement(Statement):
+    """
+    Opens the connections and console sessions listed in the `prewarm` config section, so the first commands using
+    them don't wait for the SSH handshake or the console to boot. e.g:
+
+        prewarm:
+          - host:        app1.example.com
+            handler:     rails
+            command_key: rails
+            sessions:    2
+
+    Other keys (`command_key` here) are the arguments to create the sessions, they must match the ones used when
+    checking them out to share the pool (see `tosh.lib.ssh._SSHConnection.checkout`). Prewarmed sessions stay open
+    when idle.
+    """
+
+    def __init__(self, tosh, entries):
+        """
+        Create a statement to prewarm the sessions of the given config entries.
+
+        Raise `ValueError` if any entry is not valid, e.g: with an unknown handler.
+        """
+        _check_prewarm_entries(entries)
+        super().__init__(tosh)
+        self._entries = entries
+        self.cmdline = 'prewarm'
+        self._status_line_tokens = [self._token('Prewarming SSH sessions ({} hosts)'.format(
+            len(set(entry['host'] for entry in entries))))]
+
+    async def _run(self):
+        subtasks = []
+        for entry in self._entries:
+            args = {key: value for key, value in entry.items() if key not in ('host', 'handler', 'sessions')}
+            subtasks.append((_prewarm, (entry['host'], ssh.HANDLERS[entry.get('handler', 'console')], args,
+                                        entry.get('sessions', 1)), {}))
+        results = await self.parallel(subtasks)
+        failures = ['{}: {}'.format(entry['host'], result) for entry, result in zip(self._entries, results)
+                    if isinstance(result, BaseException)]
+        if failures:
+            self._set_output_text('\n'.join(failures))
+
+
+def _check_prewarm_entries(entries):
+    if not isinstance(entries, list):
+        raise ValueError('prewarm: expected a list of hosts, got {!r}'.format(entries))
+    errors = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not isinstance(entry.get('host'), str):
+            errors.append('entry {}: expected a host and its sessions, got {!r}'.format(index, entry))
+            continue
+        handler = entry.get('handler', 'console')
+        if handler not in ssh.HANDLERS:
+            errors.append('{}: unknown handler {!r}, expected one of {}'.format(
+                entry['host'], handler, ', '.join(sorted(ssh.HANDLERS))))
+        sessions = entry.get('sessions', 1)
+        if not isinstance(sessions, int) or isinstance(sessions, bool) or sessions < 1:
+            errors.append('{}: sessions must be a positive number, got {!r}'.format(entry['host'], sessions))
+    if errors:
+        raise ValueError('Invalid prewarm config:\n' + '\n'.join(errors))
+
+
+@task('Prewarming {pos[3]} {pos[1].__name__} sessions at {pos[0]}')
+async def _prewarm(hostname, handler_class, args, count, *, task):
+    connection = await task.sub(ssh.get_connection, hostname)
+    await connection.pool(handler_class, **args).prewarm(count, task)
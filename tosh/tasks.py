@@ -1,84 +1,377 @@
 import asyncio
+import copy
 from enum import Enum
+import functools
 import os
+import re
+import time
 import traceback
 
 from prompt_toolkit.token import Token
 from prompt_toolkit.mouse_events import MouseEventType
 
+# Approximate size of a token without its text (tuple, style and mouse handler references), in bytes
+_TOKEN_SIZE = 100
+
+# Replacement fields in task title templates, e.g: {pos[0]}
+_TITLE_FIELDS = re.compile(r'\{[^}]*\}')
+
+# Time waiting for locks is only shown in the task tree when longer than this, in seconds
+_MIN_SHOWN_LOCK_WAIT = 0.01
+
+# Shared by all tasks without a status line, output or children, until they get their own. Immutable, so changing it
+# in place fails instead of changing every task: tasks assign new lists (`_add_child` replaces it before appending).
+_EMPTY = ()
+
+# Task manager showing each top level task, told when the task changes so it only joins the tokens of changed tasks
+_shown_by = {}
+
+
 class TaskManager:
-    def __init__(self, tosh):
+    """
+    List of the tasks (statements) shown in the task pane.
+
+    If an archive is given, the oldest finished tasks are moved to it when there are more than `max_tasks` of them
+    or they take more than approximately `max_bytes`. Only a one line summary of each archived task is kept in memory.
+    The size of each task is computed once, after it finishes, so adding a task doesn't walk all the live trees.
+
+    The tokens of all tasks are joined in a single list, updated in place from the first task that changed since the
+    last redraw, so a change in the last (usually running) task doesn't join the tokens of all the tasks before it.
+    """
+    def __init__(self, tosh, archive=None, max_tasks=None, max_bytes=None):
         self.tosh = tosh
+        self.archive = archive
+        self._max_tasks = max_tasks
+        self._max_bytes = max_bytes
         self._tasks = []
+        self._positions = {}
+        # Live tasks: approximate sizes of the finished ones, and the ones not finished when last checked
+        self._sizes = {}
+        self._unsized = []
+        self._live_bytes = 0
+
+        # Joined tokens of all tasks, where the tokens of each task start, and the first task changed since joining
+        self._tokens = []
+        self._offsets = []
+        self._first_changed = 0
+
+    def add(self, task):
+        """Add a task to the end of the list, archiving old tasks if over the limits."""
+        self._show(len(self._tasks), task)
+        self._tasks.append(task)
+        if self.archive is not None:
+            self._unsized.append(task)
+            self._archive_old_tasks()
+
+    def _update_sizes(self):
+        unsized = []
+        for task in self._unsized:
+            if task.archivable:
+                self._sizes[task] = task.approximate_size()
+                self._live_bytes += self._sizes[task]
+            elif not task.finished:
+                unsized.append(task)
+        self._unsized = unsized
+
+    def _archive_old_tasks(self):
+        self._update_sizes()
+        excess_tasks = len(self._sizes) + len(self._unsized) - self._max_tasks if self._max_tasks else 0
+        excess_bytes = self._live_bytes - self._max_bytes if self._max_bytes else 0
+
+        # Oldest first. Running tasks are kept, so limits may be exceeded while they run.
+        for index, task in enumerate(self._tasks):
+            if excess_tasks <= 0 and excess_bytes <= 0:
+                break
+            if task in self._sizes:
+                size = self._sizes.pop(task)
+                self._live_bytes -= size
+                excess_tasks -= 1
+                excess_bytes -= size
+                del _shown_by[task]
+                del self._positions[task]
+                archived = self.archive.archive(task)
+                self._show(index, archived)
+                self._tasks[index] = archived
+
+    def _show(self, index, task):
+        self._positions[task] = index
+        _shown_by[task] = self
+        self._changed(task)
+
+    def _changed(self, task):
+        self._first_changed = min(self._first_changed, self._positions[task])
 
     def get_tokens(self, _):
         if not self._tasks:
             return [(Token.Result, 'No tasks\n')]
 
-        tokens = []
-        for index, task in enumerate(self._tasks):
-            if index > 0:
-                tokens.append((Token.Task.Separator, '\n'))
-            tokens += task.tokens()
+        # Keep the tokens of the tasks before the first changed one, join the (cached) tokens of the rest again.
+        # prompt_toolkit keys its rendering cache on a copy of the tokens, so updating the list in place is safe.
+        start = self._first_changed
+        if start < len(self._tasks):
+            tokens = self._tokens
+            if start < len(self._offsets):
+                del tokens[self._offsets[start]:]
+                del self._offsets[start:]
+            for index in range(start, len(self._tasks)):
+                self._offsets.append(len(tokens))
+                if index > 0:
+                    tokens.append((Token.Task.Separator, '\n'))
+                tokens += self._tasks[index].tokens()
+            self._first_changed = len(self._tasks)
 
-        return tokens
+        return self._tokens
+
+    def cancel_last(self):
+        """Cancel the most recent running task. Return False if there is none."""
+        for task in reversed(self._tasks):
+            if task._status is Task.Status.Running:
+                task.cancel()
+                return True
+        return False
 
     def refresh(self):
         self.tosh.refresh()
 
 
 class Task:
-    Status = Enum('Status', ['Waiting', 'Running', 'Success', 'Error'])
+    """
+    Base class for tasks, which show their status, children and output in the task pane.
+
+    Rendered tokens are cached until the task changes. Setting `_status`, `_status_line_tokens` or
+    `_output_token_lines` marks the task as changed. Assign new lists to them instead of modifying them in place
+    (or call `_invalidate()` after doing so).
+
+    Tasks record when they were created, started running and finished (from their status), and the time spent waiting
+    for locks acquired with `locked()`. See the `profile` command.
+
+    Fan-outs create thousands of tasks, so attributes are in `__slots__`, tasks without children or output share an
+    empty tuple, and all tokens of a task share a single bound mouse handler. Subclasses not declaring `__slots__` get
+    a `__dict__` as usual.
+    """
+    __slots__ = ('_tosh', '_created', '_started', '_ended', 'lock_wait', '_parent', '_lines_cache', '_tokens_cache',
+                 '_status_value', '_status_line', '_output_lines', '_children', '_handler')
+
+    Status = Enum('Status', ['Waiting', 'Running', 'Success', 'Error', 'Cancelled', 'Cached'])
+    _FINISHED = (Status.Success, Status.Error, Status.Cancelled, Status.Cached)
+    _ATTENTION = (Status.Error, Status.Cancelled, Status.Cached)
 
     def __init__(self, tosh):
         self._tosh = tosh
+        self._handler = self._mouse_handler
+        self._created = time.monotonic()
+        self._started = None
+        self._ended = None
+        self.lock_wait = 0
+        self._parent = None
+        self._lines_cache = None
+        self._tokens_cache = None
         self._status = Task.Status.Waiting
-        self._status_line_tokens = []
-        self._output_token_lines = []
-        self._children = []
+        self._status_line_tokens = _EMPTY
+        self._output_token_lines = _EMPTY
+        self._children = _EMPTY
+
+    @property
+    def _status(self):
+        return self._status_value
+
+    @_status.setter
+    def _status(self, status):
+        self._status_value = status
+        if status is Task.Status.Running and self._started is None:
+            self._started = time.monotonic()
+        elif status in Task._FINISHED:
+            self._ended = time.monotonic()
+        self._invalidate()
+
+    @property
+    def _status_line_tokens(self):
+        return self._status_line
+
+    @_status_line_tokens.setter
+    def _status_line_tokens(self, tokens):
+        self._status_line = tokens
+        self._invalidate()
+
+    @property
+    def _output_token_lines(self):
+        return self._output_lines
+
+    @_output_token_lines.setter
+    def _output_token_lines(self, lines):
+        self._output_lines = lines
+        self._invalidate()
+
+    def _invalidate(self):
+        """Drop the rendered tokens of this task and of the ancestors showing them, telling the task manager."""
+        self._lines_cache = None
+        self._tokens_cache = None
+        # A task with no cached lines has no ancestors with cached lines including its own, no need to go further up
+        # (the task manager was told when they were dropped)
+        task = self
+        parent = self._parent
+        while parent is not None and parent._lines_cache is not None:
+            parent._lines_cache = None
+            parent._tokens_cache = None
+            task = parent
+            parent = parent._parent
+        if parent is None:
+            manager = _shown_by.get(task)
+            if manager is not None:
+                manager._changed(task)
+
+    @property
+    def wait_time(self):
+        """Seconds between creating and starting this task (e.g: waiting for a parallel slot)."""
+        return (self._started or time.monotonic()) - self._created
+
+    @property
+    def duration(self):
+        """Seconds this task has been running, or ran until it finished. None if not started."""
+        if self._started is None:
+            return None
+        return (self._ended or time.monotonic()) - self._started
+
+    @property
+    def profile_title(self):
+        """Title to aggregate timings of similar tasks, see the `profile` command."""
+        return ''.join(token[1] for token in self._status_line_tokens)
+
+    def _max_parallel(self):
+        """Maximum subtasks to run at the same time when fanning out, from the `tasks: max_parallel` config option."""
+        config = self._tosh.config
+        return config.get('tasks', 'max_parallel') if config is not None else None
+
+    def locked(self, lock):
+        """Return an async context manager acquiring a lock, adding the time spent waiting to `lock_wait`."""
+        return _TimedLock(lock, self)
+
+    def walk(self, depth=0):
+        """Iterate over this task and its descendants, as (depth, task) tuples, depth first."""
+        yield depth, self
+        for child in self._children:
+            yield from child.walk(depth + 1)
+
+    @property
+    def finished(self):
+        return self._status in Task._FINISHED
+
+    @property
+    def archivable(self):
+        """Whether this task can be moved to the task archive, only once it has finished."""
+        return self.finished
+
+    def approximate_size(self):
+        """Return the approximate memory used by the tokens of this task and its children, in bytes."""
+        lines = [self._status_line_tokens]
+        lines += self._output_token_lines
+        size = sum(_TOKEN_SIZE + len(token[1]) for line in lines for token in line)
+        return size + sum(child.approximate_size() for child in self._children)
+
+    def _add_child(self, task):
+        task._parent = self
+        if self._children is _EMPTY:
+            self._children = []
+        self._children.append(task)
+        self._invalidate()
 
     def _set_output_text(self, text):
         self._output_token_lines = [[self._token(line)] for line in text.split('\n')]
 
     def tokens(self):
-        tokens = []
-        for line in self._token_lines():
-            tokens += line + [self._token('\n')]
-        return tokens
+        if self._tokens_cache is None:
+            tokens = []
+            newline = self._token('\n')
+            for line in self._token_lines():
+                tokens += line
+                tokens.append(newline)
+            self._tokens_cache = tokens
+        return self._tokens_cache
 
     def _token_lines(self):
-        status_line = self._status_tokens() + [self._token(' ')] + self._status_line_tokens
-        return [status_line] + self._children_token_lines() + self._output_token_lines
+        if self._lines_cache is None:
+            status_line = self._status_tokens() + [self._token(' ')]
+            status_line += self._status_line_tokens
+            status_line += self._timing_tokens()
+            lines = [status_line] + self._children_token_lines()
+            lines += self._output_token_lines
+            self._lines_cache = lines
+        return self._lines_cache
 
     def _children_token_lines(self):
         token_lines = []
-        active_children = any(child._status is not Task.Status.Success for child in self._children)
+        # Show finished children too if any result comes from a cache (possibly stale) or any descendant failed
+        active_children = any(child._status is not Task.Status.Success or child._needs_attention()
+                              for child in self._children)
         if self._children and active_children:
+            # Tokens are immutable, the tree lines of all children share them
+            branch, trunk = self._token('├╴'), self._token('│ ')
             for child in self._children[:-1]:
                 lines = child._token_lines()
-                token_lines.append([self._token('├╴')] + lines[0])
+                token_lines.append([branch] + lines[0])
                 for l in lines[1:]:
-                    token_lines.append([self._token('│ ')] + l)
-                pass
+                    token_lines.append([trunk] + l)
             last_child = self._children[-1]
             lines = last_child._token_lines()
             token_lines.append([self._token('└╴')] + lines[0])
+            space = self._token('  ')
             for l in lines[1:]:
-                token_lines.append([self._token('  ')] + l)
+                token_lines.append([space] + l)
         return token_lines
 
+    def text_lines(self):
+        """Return the lines of this task, as plain text."""
+        return [''.join(token[1] for token in line) for line in self._token_lines()]
+
+    def as_dict(self):
+        """Return a dictionary describing this task and its children, e.g: to output as JSON."""
+        return {
+            'title':    ''.join(token[1] for token in self._status_line_tokens),
+            'status':   self._status.name.lower(),
+            'output':   [''.join(token[1] for token in line) for line in self._output_token_lines],
+            'children': [child.as_dict() for child in self._children]
+        }
+
     def _token(self, text, style=Token.Task.Result):
-        return (style, text, self._mouse_handler)
+        return (style, text, self._handler)
 
     def _status_tokens(self):
         STATUS_TEMPLATES = {
             Task.Status.Waiting: 'task.status.waiting',
             Task.Status.Running: 'task.status.running',
             Task.Status.Success: 'task.status.success',
-            Task.Status.Error:   'task.status.error'
+            Task.Status.Error:   'task.status.error',
+            Task.Status.Cancelled: 'task.status.cancelled',
+            Task.Status.Cached:    'task.status.cached'
         }
         template = STATUS_TEMPLATES[self._status]
-        return self._tosh.style.get_template(template, mouse_handler=self._mouse_handler)
+        return self._tosh.style.get_template(template, mouse_handler=self._handler)
+
+    def _needs_attention(self):
+        return self._status in Task._ATTENTION or any(child._needs_attention() for child in self._children)
+
+    def _cache_hit(self, age, cache=None):
+        """
+        Mark this task as finished instantly with a cached result, loaded `age` seconds ago.
+
+        If the result comes from a `ResultCache`, its hit and miss counts are shown too.
+        """
+        tokens = self._tosh.style.get_template('task.cached', mouse_handler=self._handler, age=format_duration(age))
+        if cache is not None:
+            tokens += self._tosh.style.get_template('task.cached.stats', mouse_handler=self._handler,
+                                                    cache=cache.name, hits=cache.hits, misses=cache.misses)
+        self._status_line_tokens = list(self._status_line_tokens) + tokens
+        self._status = Task.Status.Cached
+
+    def _timing_tokens(self):
+        if self._ended is None or self._started is None:
+            return []
+        tokens = self._tosh.style.get_template('task.duration', mouse_handler=self._handler,
+                                               duration=format_duration(self.duration))
+        if self.lock_wait >= _MIN_SHOWN_LOCK_WAIT:
+            tokens += self._tosh.style.get_template('task.duration.locked', mouse_handler=self._handler,
+                                                    lock_wait=format_duration(self.lock_wait))
+        return tokens
 
     def _mouse_handler(self, _, event):
         if event.event_type == MouseEventType.MOUSE_DOWN:
@@ -87,42 +380,180 @@ class Task:
             return NotImplemented
 
     def _clicked(self):
-        pass
+        if self._status is Task.Status.Running:
+            self.cancel()
+
+    def cancel(self):
+        """Cancel the whole task tree (statement) this task belongs to, see `Statement.cancel`."""
+        if self._parent is not None:
+            self._parent.cancel()
+
+    async def sub(self, task_or_func, *args, _timeout=None, **kwargs):
+        """
+        Run a subtask, given as a task or a task function and its arguments. Return its result.
 
-    async def sub(self, task_or_func, *args, **kwargs):
+        If `_timeout` is given, the subtask is cancelled after that many seconds, raising `asyncio.TimeoutError`.
+        """
         if isinstance(task_or_func, Task):
             _task = task_or_func
         else:
             _task = task_or_func(*args, **kwargs, _tosh=self._tosh)
             assert isinstance(_task, Task), str(task_or_func) + ' is not a task'
-        self._children.append(_task)
-        result = await _task.run()
+        self._add_child(_task)
+        result = await asyncio.wait_for(_task.run(), _timeout)
         return result
 
-    async def parallel(self, tasks):
-        _parallel_tasks = []
+    async def parallel(self, tasks, limit=None):
+        """
+        Run subtasks in parallel, given as (task function, args, kwargs) tuples. Return their results (or exceptions).
+
+        If `limit` is given, at most that many subtasks run at the same time, the rest show as waiting.
+        """
+        results = await asyncio.gather(*self._start_parallel(tasks, limit), return_exceptions=True)
+        return results
+
+    def parallel_stream(self, tasks, limit=None):
+        """
+        Like `parallel`, but return a `ParallelResults` async iterator of (index, result or exception) tuples, in the
+        order subtasks finish. Use it in an `async with` block, so leaving it early (e.g: cancelled, or breaking the
+        loop) cancels the subtasks still running or waiting to start:
+
+            async with self.parallel_stream(tasks, limit=10) as results:
+                async for index, result in results:
+                    ...
+        """
+        return ParallelResults(self._start_parallel(tasks, limit))
+
+    def _start_parallel(self, tasks, limit):
+        semaphore = asyncio.Semaphore(limit) if limit else None
+        futures = []
         for (task_func, args, kwargs) in tasks:
             _task = task_func(*args, **kwargs, _tosh=self._tosh)
             assert isinstance(_task, Task), str(task_func) + ' is not a task'
-            self._children.append(_task)
-            _parallel_tasks.append(asyncio.ensure_future(_task.run()))
+            self._add_child(_task)
+            futures.append(asyncio.ensure_future(run_limited(_task, semaphore)))
+        return futures
+
+
+class _TimedLock:
+    """Async context manager for a lock, recording the time spent waiting for it in a task."""
+
+    def __init__(self, lock, task):
+        self._lock = lock
+        self._task = task
+
+    async def __aenter__(self):
+        start = time.monotonic()
+        await self._lock.acquire()
+        self._task.lock_wait += time.monotonic() - start
+
+    async def __aexit__(self, *_):
+        self._lock.release()
+
+
+def format_duration(seconds):
+    """Format a duration for humans, e.g: 350ms, 2.4s."""
+    if seconds < 1:
+        return '{:.0f}ms'.format(seconds * 1000)
+    return '{:.1f}s'.format(seconds)
+
+
+async def run_limited(task, semaphore):
+    """Run a task once the semaphore allows, or right away if None."""
+    if semaphore is None:
+        return await task.run()
+    async with semaphore:
+        return await task.run()
+
+
+class ParallelResults:
+    """
+    Async iterator over the results of parallel subtasks, as (index, result or exception), as they finish.
+
+    Leaving its `async with` block, calling `aclose()` or cancelling the task waiting for the next result cancels the
+    subtasks not finished yet, so queued ones never start.
+    """
+
+    def __init__(self, futures):
+        """Initialize the iterator over the futures of already started subtasks."""
+        self._futures = futures
+        self._remaining = len(futures)
+        self._finished = asyncio.Queue()
+        for index, future in enumerate(futures):
+            future.add_done_callback(functools.partial(self._on_done, index))
+
+    def _on_done(self, index, future):
+        self._finished.put_nowait((index, future))
+
+    def __aiter__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        self.cancel()
+
+    async def __anext__(self):
+        if not self._remaining:
+            raise StopAsyncIteration
+        try:
+            index, future = await self._finished.get()
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        self._remaining -= 1
+        if future.cancelled():
+            return index, asyncio.CancelledError()
+        return index, future.exception() or future.result()
+
+    def cancel(self):
+        """Cancel the subtasks still waiting or running, and stop iterating."""
+        for future in self._futures:
+            future.cancel()
+        self._remaining = 0
+
+    async def aclose(self):
+        """Like `cancel`, for `async for` loops left early."""
+        self.cancel()
 
-        results = await asyncio.gather(*_parallel_tasks, return_exceptions=True)
-        return results
 
 class CoroutineTask(Task):
-    def __init__(self, tosh, coroutine, title):
+    __slots__ = ('_coroutine', '_profile_title', '_cache', '_cache_key')
+
+    def __init__(self, tosh, coroutine, title, profile_title=None, cache=None, cache_key=None):
         super().__init__(tosh)
         self._coroutine = coroutine
+        self._profile_title = profile_title or title
+        self._cache = cache
+        self._cache_key = cache_key
         self._status_line_tokens = [self._token(title)]
 
+    @property
+    def profile_title(self):
+        """The title without arguments (e.g: `Connecting to *`), so all calls of a task function are aggregated."""
+        return self._profile_title
+
     async def run(self):
+        if self._cache is not None:
+            found, result, age = self._cache.get(self._cache_key)
+            if found:
+                self._coroutine.close()
+                self._cache_hit(age, self._cache)
+                # A copy, like for variable loads, so callers can't change the cached result
+                return copy.copy(result)
+
         self._status = Task.Status.Running
         self._tosh.refresh()
         try:
             result = await self._coroutine
+            if self._cache is not None:
+                self._cache.put(self._cache_key, result)
             self._status = Task.Status.Success
             return result
+        except asyncio.CancelledError:
+            self._status = Task.Status.Cancelled
+            raise
         except BaseException as e:
             self._status = Task.Status.Error
             raise e
@@ -131,20 +562,32 @@ class CoroutineTask(Task):
 
 
 class FakeTask:
+    """Stand-in for the task of a task function called without `_tosh`, running subtasks directly."""
+
+    def locked(self, lock):
+        return lock
+
     async def sub(self, task_func, *args, **kwargs):
         if isinstance(task_func, Task):
             return (await task_func.run())
         else:
             return (await task_func(*args, **kwargs))
 
+
 # Decorator
-def task(title):
+def task(title, cache=None):
+    """
+    Decorate a coroutine function to return a task running it, with the given title.
+
+    If a `ResultCache` (see `tosh.cache`) is given, results are cached by arguments.
+    """
     def task_decorator(func):
         def task_method(*args, **kwargs):
             try:
                 tosh = kwargs.pop('_tosh')
                 _task = CoroutineTask.__new__(CoroutineTask)
-                _task.__init__(tosh, func(*args, **kwargs, task=_task), title.format(pos=args, kw=kwargs))
+                _task.__init__(tosh, func(*args, **kwargs, task=_task), title.format(pos=args, kw=kwargs),
+                               _TITLE_FIELDS.sub('*', title), cache, (args, tuple(sorted(kwargs.items()))))
                 return _task
             except KeyError:
                 return func(*args, **kwargs, task=FakeTask())
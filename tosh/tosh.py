@@ -12,23 +12,40 @@ from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
 
 from .ui.key_bindings import get_key_bindings
 from .ui.main_window import MainWindow
+from .ui.redraw import RedrawScheduler
 from .ui.style import ToshStyle
+from .archive import TaskArchive
 from .tasks import TaskManager
 from .parser import CommandLineParser
 from .completer import CommandLineCompleter
-from .statements import Statement, ErrorStatement
+from .startup_profile import StartupProfile
+from .statements import Statement, ErrorStatement, PrewarmStatement
+from .variable import VariableStore
 
 class Tosh:
-    def __init__(self, base_dir, config):
+    def __init__(self, base_dir, config, profile=None):
+        profile = profile or StartupProfile()
         for module in config.get('modules'):
-            import_module(module)
+            with profile.phase('import module ' + module):
+                import_module(module)
 
-        self.tasks = TaskManager(self)
+        self.tasks = TaskManager(
+            self,
+            archive=TaskArchive(base_dir + '/archive.jsonl'),
+            max_tasks=config.get('tasks', 'max_live') or 200,
+            max_bytes=config.get('tasks', 'max_bytes') or 50 * 1024 * 1024
+        )
+        # The parser loads the lexer tables shared by the lexers of the UI, so it must be created first
+        with profile.phase('parser tables load'):
+            self._parser = CommandLineParser(self, base_dir)
+        with profile.phase('UI setup'):
+            self._create_ui(base_dir, config, profile)
+        self.config = config
+        self.variables = VariableStore()
+
+    def _create_ui(self, base_dir, config, profile):
         self.window = MainWindow(self)
         self.style = ToshStyle(config.get('ui', 'style'))
-        self._parser = CommandLineParser(self, base_dir)
-        self.config = config
-        self.variables = {}
 
         application = Application(
             layout=self.window,
@@ -45,7 +62,8 @@ class Tosh:
             mouse_support=config.get('ui', 'mouse'),
             style=self.style,
             key_bindings_registry=get_key_bindings(self),
-            use_alternate_screen=True
+            use_alternate_screen=True,
+            on_render=profile.first_prompt
         )
 
         self._cli = CommandLineInterface(
@@ -53,9 +71,14 @@ class Tosh:
             eventloop=create_asyncio_eventloop(),
             output=create_output(true_color=True)
         )
+        self.redraw = RedrawScheduler(self._cli.request_redraw, config.get('ui', 'max_fps') or 30)
 
-    def refresh(self):
-        self._cli.request_redraw()
+    def refresh(self, immediate=False):
+        """Request a redraw. Requests are coalesced to a maximum frame rate unless `immediate`."""
+        self.redraw.request(immediate)
+
+    def exit(self):
+        self._cli.exit()
 
     def _exception_handler(self, loop, context):
         self._cli.reset()
@@ -68,9 +91,20 @@ class Tosh:
         for cmd in self.config.get('autostart'):
             cmd_task = self._parser.parse(cmd)
             cmd_task.set_cmdline(cmd)
-            self.tasks._tasks.append(cmd_task)
+            self.tasks.add(cmd_task)
             asyncio.ensure_future(cmd_task.run())
 
+        # Runs once the UI is up, as the event loop starts with it
+        prewarm = self.config.get('prewarm')
+        if prewarm:
+            try:
+                prewarm_task = PrewarmStatement(self, prewarm)
+            except ValueError as e:
+                self.tasks.add(ErrorStatement(self, 'prewarm', str(e)))
+            else:
+                self.tasks.add(prewarm_task)
+                asyncio.ensure_future(prewarm_task.run())
+
         asyncio.get_event_loop().set_exception_handler(self._exception_handler)
         try:
             asyncio.get_event_loop().run_until_complete(self._cli.run_async())
@@ -85,12 +119,12 @@ class Tosh:
             if isinstance(cmd_task, Statement):
                 cmd_task.set_cmdline(document.text)
                 document.reset(append_to_history=True)
-                self.tasks._tasks.append(cmd_task)
+                self.tasks.add(cmd_task)
                 asyncio.ensure_future(cmd_task.run())
             else:
-                self.tasks._tasks.append(ErrorStatement(self, document.text, "Parser returned no task"))
+                self.tasks.add(ErrorStatement(self, document.text, "Parser returned no task"))
                 document.reset(append_to_history=False)
         except BaseException as e:
             # Last resort error handler
-            self.tasks._tasks.append(ErrorStatement(self, document.text, traceback.format_exc()))
+            self.tasks.add(ErrorStatement(self, document.text, traceback.format_exc()))
             document.reset(append_to_history=False)
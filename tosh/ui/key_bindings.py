@@ -4,8 +4,6 @@ from prompt_toolkit.keys import Keys
 from prompt_toolkit.filters import Condition
 from prompt_toolkit.key_binding.bindings.basic import load_mouse_bindings
 
-from pymux.key_mappings import prompt_toolkit_key_to_vt100_key
-
 
 def _active_tab(cli):
     return cli.application.layout.active_tab()
@@ -41,8 +39,17 @@ def get_key_bindings(tosh):
         from .tosh_tab import ToshTab
         tosh.window.add_tab(ToshTab(tosh))
 
+    @prompt_registry.add_binding(Keys.ControlC)
+    def _cancel_or_clear(event):
+        # Clear the command line if there is any text, else cancel the last running statement
+        if event.current_buffer.text:
+            event.current_buffer.reset()
+        else:
+            tosh.tasks.cancel_last()
+
     @interactive_registry.add_binding(Keys.Any)
     def _forward_to_session(event):
+        from pymux.key_mappings import prompt_toolkit_key_to_vt100_key
         tosh.window.active_tab().write_to_ssh(prompt_toolkit_key_to_vt100_key(event.key_sequence[0].key, True))
 
     @global_registry.add_binding(Keys.ControlB, '1')
@@ -55,7 +55,7 @@ class MainWindow(HSplit):
         self._tabs.remove(tab)
         self._tosh.refresh()
         if not self._tabs:
-            self._tosh._cli.exit()
+            self._tosh.exit()
 
     def _get_tabs_tokens(self, _):
         tokens = []
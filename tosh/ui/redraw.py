@@ -0,0 +1,40 @@
+"""Coalescing of redraw requests."""
+import asyncio
+
+
+class RedrawScheduler:
+    """
+    Coalesce redraw requests into at most `max_fps` frames per second.
+
+    Requests made while a frame is pending are merged into it. Immediate requests (e.g: echo of a keystroke) draw right
+    away, merging any pending frame instead.
+    """
+
+    def __init__(self, redraw, max_fps=30):
+        """Initialize the scheduler, given a function doing the actual redraw."""
+        self._redraw = redraw
+        self._interval = 1 / max_fps if max_fps else 0
+        self._handle = None
+        self._last_frame = None
+        self.requested = 0
+        self.drawn = 0
+
+    def request(self, immediate=False):
+        """Request a redraw, as soon as the frame rate allows or right away if `immediate`."""
+        self.requested += 1
+        loop = asyncio.get_event_loop()
+        if immediate:
+            if self._handle:
+                self._handle.cancel()
+            self._draw()
+        elif self._handle is None:
+            delay = 0
+            if self._last_frame is not None:
+                delay = max(0, self._last_frame + self._interval - loop.time())
+            self._handle = loop.call_later(delay, self._draw)
+
+    def _draw(self):
+        self._handle = None
+        self._last_frame = asyncio.get_event_loop().time()
+        self.drawn += 1
+        self._redraw()
@@ -30,6 +30,11 @@ style = {
     Token.Task.Status.Running:  '#1785FB',
     Token.Task.Status.Success:  '#73C86B',
     Token.Task.Status.Error:    '#f24440',
+    Token.Task.Status.Cancelled: '#E5A03A',
+    Token.Task.Status.Cached:   '#8364C5',
+    Token.Task.Cached:          '#8364C5',
+    Token.Task.Archived:        '#647083',
+    Token.Task.Duration:        '#647083',
 
     Token.Prompt:               '#f24440',
     Token.Prompt.Text:          '#fff bg:#f24440',
@@ -50,6 +55,12 @@ templates = {
     'task.status.running': [(Token.Task.Status.Running, '●')],
     'task.status.success': [(Token.Task.Status.Success, '✔')],
     'task.status.error':   [(Token.Task.Status.Error,   '✖')],
+    'task.status.cancelled': [(Token.Task.Status.Cancelled, '⊘')],
+    'task.status.cached':    [(Token.Task.Status.Cached, '↺')],
+    'task.cached':           [(Token.Task.Cached, ' (cached, {age} old)')],
+    'task.cached.stats':     [(Token.Task.Cached, ' ({cache} cache: {hits} hits, {misses} misses)')],
+    'task.duration':         [(Token.Task.Duration, ' ({duration})')],
+    'task.duration.locked':  [(Token.Task.Duration, ' (waited {lock_wait} for lock)')],
 
     # Prompt
     'prompt': [(Token.Prompt.Text, 'tosh'), (Token.Prompt, '▌')]
@@ -33,7 +33,7 @@ class ToshWindow(HSplit):
             get_prompt_tokens=self.get_prompt_tokens,
             reserve_space_for_menu=4,
             display_completions_in_columns=True,
-            lexer=CommandLineLexer(self._tosh)
+            lexer=CommandLineLexer(self._tosh, classify=True)
         )
         layout = [
             ScrollWindow(
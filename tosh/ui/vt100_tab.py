@@ -5,14 +5,15 @@ from prompt_toolkit.mouse_events import MouseEventType
 from prompt_toolkit.layout.containers import Container
 from prompt_toolkit.layout.screen import Point
 from prompt_toolkit.layout.dimension import LayoutDimension
-from pymux.screen import BetterScreen
-from pymux.stream import BetterStream
 
-from ..lib.ssh import _SSHInteractiveHandler
 from .tab import Tab
 
+# Output received this soon after input (in seconds) is probably its echo, and is drawn without waiting for a frame
+_ECHO_WINDOW = 0.1
+
 
 def create_interactive_tab(tosh, session):
+    from ..lib.ssh import _SSHInteractiveHandler
     tab = Vt100Tab(tosh, session)
     session.switch_handler(functools.partial(_SSHInteractiveHandler, tab))
     return tab
@@ -23,7 +24,11 @@ class Vt100Tab(Tab):
         super().__init__(tosh)
         self.title = 'SSH'
         self._session = session
+        self._last_input = None
 
+        # pymux is slow to import, only import it when the first interactive tab is opened
+        from pymux.screen import BetterScreen
+        from pymux.stream import BetterStream
         self._screen = BetterScreen(20, 80, self.write_to_ssh)
         self._stream = BetterStream(self._screen)
         self._stream.attach(self._screen)
@@ -34,11 +39,13 @@ class Vt100Tab(Tab):
         self.write_to_ssh(event.data)
 
     def write_to_ssh(self, data):
+        self._last_input = asyncio.get_event_loop().time()
         self._session.channel.write(data)
 
     def write_to_screen(self, data):
         self._stream.feed(data)
-        self._tosh.refresh()
+        echo = self._last_input is not None and asyncio.get_event_loop().time() - self._last_input < _ECHO_WINDOW
+        self._tosh.refresh(immediate=echo)
 
     def set_size(self, w, h):
         self._session.channel.change_terminal_size(w, h)
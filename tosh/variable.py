@@ -1,40 +1,158 @@
 """Definition of base variable and loading tasks."""
+import asyncio
+from collections import UserDict
+import copy
 import re
+import time
 
 from prompt_toolkit.token import Token
 
+from . import generation
 from .tasks import task, Task
 
 
 class LoadVariableTask(Task):
-    """Task to load a variable from a variable literal or similar."""
+    """
+    Task to load a variable from a variable literal or similar.
+
+    Concurrent loads of the same variable class and argument share a single load (see `_shared_load`). Each task still
+    shows in the task tree, marked as shared if attached to a load started by another task, with the shared load (and
+    its subtasks) as its child. Results are cached if the
+    variable class has a `result_cache`, by variable class and argument (subclasses may inherit the same cache).
+    """
+
+    __slots__ = ('return_type', '_loader', '_argument', 'bare_word')
+
+    # Loads running, by (variable class, argument): [future, number of tasks waiting for it, `_SharedLoadTask`]
+    _loads_in_flight = {}
 
     def __init__(self, tosh, return_type, argument):
         """Create a task to laod a variable given an argument (e.g: username)."""
         super().__init__(tosh)
         self.return_type = Variable[return_type]
+        self._loader = self.return_type
         self._argument = argument
         self.bare_word = argument
         self._status_line_tokens = [self._token('Loading {} {}'.format(self.return_type.class_name, self._argument))]
 
+    @property
+    def profile_title(self):
+        """Title without the argument, so loads of the same type are aggregated."""
+        return 'Loading {}'.format(self.return_type.class_name)
+
     async def run(self):
         """Run this task, that will load the variable by calling `_load`."""
+        cache = self._loader.result_cache
+        if cache is not None:
+            found, result, age = cache.get((self._loader, self._argument))
+            if found:
+                self._cache_hit(age, cache)
+                return copy.copy(result)
+
         self._status = Task.Status.Running
         self._tosh.refresh()
         try:
-            result = await self.return_type._load(self._argument, self)
+            result = await self._shared_load(self._loader)
+            if cache is not None:
+                cache.put((self._loader, self._argument), result)
             self._status = Task.Status.Success
             return result
+        except asyncio.CancelledError:
+            self._status = Task.Status.Cancelled
+            raise
         except BaseException as e:
             self._status = Task.Status.Error
             raise e
         finally:
             self._tosh.refresh()
 
+    async def _shared_load(self, loader):
+        """
+        Load the variable with `loader._load`, or wait for the same load started by another task.
+
+        The load runs in a `_SharedLoadTask`, so its subtasks don't belong to any of the tasks waiting for it, and is
+        only cancelled if all of them are cancelled. Tasks attached to a load started by another one get a copy of the
+        result, so they can be assigned to different variables.
+        """
+        key = (loader, self._argument)
+        in_flight = LoadVariableTask._loads_in_flight.get(key)
+        shared = in_flight is not None
+        if shared:
+            self._status_line_tokens = self._status_line_tokens + [self._token(' (shared)')]
+        else:
+            load = _SharedLoadTask(self._tosh, loader, self._argument)
+            future = asyncio.ensure_future(load.run())
+            in_flight = LoadVariableTask._loads_in_flight[key] = [future, 0, load]
+            future.add_done_callback(lambda _: self._forget_load(key, in_flight))
+
+        in_flight[2].attach(self)
+        in_flight[1] += 1
+        try:
+            result = await asyncio.shield(in_flight[0])
+        finally:
+            in_flight[1] -= 1
+            if in_flight[1] == 0:
+                in_flight[0].cancel()
+                self._forget_load(key, in_flight)
+        return copy.copy(result) if shared else result
+
+    @staticmethod
+    def _forget_load(key, in_flight):
+        if LoadVariableTask._loads_in_flight.get(key) is in_flight:
+            del LoadVariableTask._loads_in_flight[key]
+
+
+class _SharedLoadTask(Task):
+    """
+    Task running a variable load for all the `LoadVariableTask`s waiting for it (see `LoadVariableTask._shared_load`).
+
+    It has no parent of its own: it shows as a child of each of the tasks waiting for it, and changes are shown in
+    all of them.
+    """
+
+    __slots__ = ('_parents', '_loader', '_argument')
+
+    def __init__(self, tosh, loader, argument):
+        super().__init__(tosh)
+        self._parents = []
+        self._loader = loader
+        self._argument = argument
+        self._status_line_tokens = [self._token('Load of {} {}'.format(loader.class_name, argument))]
+
+    @property
+    def profile_title(self):
+        return 'Load of {}'.format(self._loader.class_name)
+
+    def attach(self, parent):
+        """Show this task as a child of another one."""
+        parent._add_child(self)
+        self._parent = None
+        self._parents.append(parent)
+
+    def _invalidate(self):
+        super()._invalidate()
+        for parent in getattr(self, '_parents', ()):
+            parent._invalidate()
+
+    async def run(self):
+        self._status = Task.Status.Running
+        try:
+            result = await self._loader._load(self._argument, self)
+            self._status = Task.Status.Success
+            return result
+        except asyncio.CancelledError:
+            self._status = Task.Status.Cancelled
+            raise
+        except BaseException as e:
+            self._status = Task.Status.Error
+            raise e
+
 
 class AttributeAccessTask(Task):
     """Task to access the attribute of a variable."""
 
+    __slots__ = ('return_type', '_attr_name', '_base_task')
+
     def __init__(self, tosh, base_task, attr_name):
         """
         Create a task to access an attribute.
@@ -57,9 +175,74 @@ class AttributeAccessTask(Task):
         self._tosh.refresh()
         try:
             base_object = await self.sub(self._base_task)
+            found, result, age = base_object.cached_attribute(self._attr_name)
+            if found:
+                self._cache_hit(age)
+                return result
             result = await base_object.attribute(self._attr_name, self)
             self._status = Task.Status.Success
             return result
+        except asyncio.CancelledError:
+            self._status = Task.Status.Cancelled
+            raise
+        except BaseException as e:
+            self._status = Task.Status.Error
+            raise e
+        finally:
+            self._tosh.refresh()
+
+
+class MapAttributeTask(Task):
+    """
+    Task to access an attribute of every item of a list (`list.*.attribute`), returning a list of the values.
+
+    Items are accessed concurrently, at most `tasks: max_parallel` (config) at a time. Items whose attribute fails are
+    left out of the result, and reported in the output.
+    """
+
+    def __init__(self, tosh, base_task, attr_name):
+        """Create a task to access an attribute of all items. `base_task` must return a list."""
+        super().__init__(tosh)
+        list_type = Variable[base_task.return_type]
+        try:
+            item_type = list_type._item_class
+        except AttributeError:
+            raise TypeError('{} is not a list'.format(list_type.class_name))
+        self._item_type = Variable[item_type.attributes[attr_name][0]]
+        self.return_type = Variable[[self._item_type]]
+        self._attr_name = attr_name
+        self._base_task = base_task
+        self._status_line_tokens = [self._token('Accessing {}.*.{}'.format(list_type.class_name, attr_name))]
+
+    async def run(self):
+        """Run the task."""
+        from .vars.basic import List
+        self._status = Task.Status.Running
+        self._tosh.refresh()
+        try:
+            items = await (await self.sub(self._base_task)).items()
+            limit = self._max_parallel()
+            semaphore = asyncio.Semaphore(limit) if limit else None
+
+            async def _attribute(item):
+                found, value, _ = item.cached_attribute(self._attr_name)
+                if found:
+                    return value
+                if semaphore is None:
+                    return await item.attribute(self._attr_name, self)
+                async with semaphore:
+                    return await item.attribute(self._attr_name, self)
+
+            results = await asyncio.gather(*[_attribute(item) for item in items], return_exceptions=True)
+            failures = ['Item {} failed: {!r}'.format(index, result) for index, result in enumerate(results)
+                        if isinstance(result, BaseException)]
+            if failures:
+                self._set_output_text('\n'.join(failures))
+            self._status = Task.Status.Success
+            return List(self._item_type, [result for result in results if not isinstance(result, BaseException)])
+        except asyncio.CancelledError:
+            self._status = Task.Status.Cancelled
+            raise
         except BaseException as e:
             self._status = Task.Status.Error
             raise e
@@ -75,6 +258,8 @@ class GetVariableTask(Task):
     all commands can operate on tasks.
     """
 
+    __slots__ = ('_varname', 'return_type')
+
     def __init__(self, tosh, varname):
         """Create a task to return a variable."""
         super().__init__(tosh)
@@ -83,9 +268,30 @@ class GetVariableTask(Task):
         self._status_line_tokens = [self._token('Get variable {} ({})'.format(varname, self.return_type.class_name))]
 
     async def run(self):
-        """Just return the variable synchronously."""
-        self._status = Task.Status.Success
-        return self._var()
+        """Just return the variable synchronously, unless it is lazy and has to be evaluated first."""
+        variable = self._var()
+        if not isinstance(variable, LazyVariable):
+            self._status = Task.Status.Success
+            return variable
+
+        self._status = Task.Status.Running
+        self._tosh.refresh()
+        try:
+            result = await variable.evaluate(self)
+            # Replace the lazy variable, unless assigned again while evaluating
+            if self._tosh.variables.get(self._varname) is variable:
+                result.var_name = self._varname
+                self._tosh.variables[self._varname] = result
+            self._status = Task.Status.Success
+            return result
+        except asyncio.CancelledError:
+            self._status = Task.Status.Cancelled
+            raise
+        except BaseException as e:
+            self._status = Task.Status.Error
+            raise e
+        finally:
+            self._tosh.refresh()
 
     def _var(self):
         return self._tosh.variables[self._varname]
@@ -96,6 +302,60 @@ class GetVariableTask(Task):
         return self._varname
 
 
+class LazyVariable:
+    """
+    Variable assigned with `:=`, whose expression is only evaluated when first used (see `GetVariableTask`).
+
+    It has the type of the expression, so it can be used in command lines like the actual variable. Concurrent first
+    uses share a single evaluation. If the evaluation fails, it is tried again on the next use.
+
+    It is not a `Variable`: it only has what is used on the variables of the session directly (`type`, `class_name`,
+    `tokens` and `forget_attributes`, e.g: for lexing and completion). Anything else must use the evaluated variable,
+    which only `GetVariableTask` returns, so other attributes raise `AttributeError` saying so.
+    """
+
+    __slots__ = ('_tosh', '_plan', '_future')
+
+    def __init__(self, tosh, plan):
+        """Create a lazy variable evaluating a plan."""
+        self._tosh = tosh
+        self._plan = plan
+        self._future = None
+
+    def type(self):
+        """Return the type of the variable once evaluated."""
+        return Variable[self._plan.return_type]
+
+    @property
+    def class_name(self):
+        """Class name of the variable once evaluated."""
+        return self.type().class_name
+
+    def tokens(self):
+        """Representation of the pending variable."""
+        return [(Token.Task.Result, '<{}, not evaluated yet>'.format(self.class_name))]
+
+    def forget_attributes(self, *attrnames):
+        """Nothing loaded yet."""
+        return 0
+
+    def __getattr__(self, name):
+        raise AttributeError('{!r} of a lazy variable, which must be evaluated first (see GetVariableTask)'.format(
+            name))
+
+    async def evaluate(self, task):
+        """Evaluate the expression as a subtask of `task`, or wait for the evaluation started by another task."""
+        failed = self._future is not None and self._future.done() and (
+            self._future.cancelled() or self._future.exception() is not None)
+        if self._future is None or failed:
+            expression = self._plan.build(self._tosh)
+            task._add_child(expression)
+            self._future = asyncio.ensure_future(expression.run())
+        else:
+            task._status_line_tokens = task._status_line_tokens + [task._token(' (shared)')]
+        return await asyncio.shield(self._future)
+
+
 class _VariableMeta(type):
     """
     Metaclass (object that represents a class) for Variables.
@@ -108,8 +368,10 @@ class _VariableMeta(type):
 
     class _AttributesDict(dict):
         # Decorator
-        def register(self, name, return_type):
+        def register(self, name, return_type, cached=False):
+            """Register an attribute. If `cached`, its value is kept in each instance once loaded."""
             def register_decorator(func):
+                func._cached_attribute = cached
                 self[name] = (return_type, func)
                 return func
             return register_decorator
@@ -145,6 +407,7 @@ class _VariableMeta(type):
         self.by_class_name[name] = self
         if hasattr(self, 'prefix'):
             self.by_prefix[self.prefix] = self
+        generation.bump()
 
         # Add default class/variable names
         if 'class_name' not in attrs:
@@ -162,6 +425,7 @@ class Variable(metaclass=_VariableMeta):
      - `_load()` to initialize the variable, called from a task
      - `tokens()` for screen representation
      - `load_in_box()` to be executed when opening an interactive rails session with this variable (optional)
+     - `result_cache` attribute with a `tosh.cache.ResultCache` to cache loads by argument (optional)
 
     Attributes can be registered like this (they can be plain functions or tasks (@task)):
     ```
@@ -169,8 +433,18 @@ class Variable(metaclass=_VariableMeta):
     def attribute(self):
         pass
     ```
+
+    Attributes registered with `cached=True` are loaded once per instance, until `forget_attributes` is called (e.g:
+    by assigning the variable, or with the `refresh` command).
+
+    The base attributes are in `__slots__`, so variables held by the thousand in lists can declare theirs too (see
+    `String`). Subclasses not declaring `__slots__` get a `__dict__` as usual.
     """
 
+    __slots__ = ('_tosh', '_var_name', '_attribute_cache')
+
+    result_cache = None
+
     def __init__(self, tosh):
         """Initialize the Variable."""
         self._tosh = tosh
@@ -181,6 +455,11 @@ class Variable(metaclass=_VariableMeta):
         """Return a task to initialize an instance of this variable."""
         return LoadVariableTask(tosh, cls, argument)
 
+    @classmethod
+    def load_type(cls, argument):
+        """Return the type of the variable that `load_task` loads for an argument."""
+        return cls
+
     @classmethod
     @task("Loading {pos[0].class_name} {pos[1]}")
     async def load(cls, argument, *, task):
@@ -211,6 +490,41 @@ class Variable(metaclass=_VariableMeta):
         """Set the name of the variable."""
         self._var_name = varname
 
+    def __copy__(self):
+        """Shallow copy, with its own cache of attributes."""
+        cls = self.__class__
+        clone = cls.__new__(cls)
+        for name in _slot_names(cls):
+            if name != '_attribute_cache' and hasattr(self, name):
+                setattr(clone, name, getattr(self, name))
+        if hasattr(self, '__dict__'):
+            clone.__dict__.update(self.__dict__)
+        return clone
+
+    def _attributes_cache(self):
+        # Created on first use, as not all subclasses call Variable.__init__
+        try:
+            return self._attribute_cache
+        except AttributeError:
+            self._attribute_cache = {}
+            return self._attribute_cache
+
+    def cached_attribute(self, attrname):
+        """Return a (found, value, age in seconds) tuple for the cached value of an attribute."""
+        try:
+            loaded, value = self._attributes_cache()[attrname]
+            return True, value, time.monotonic() - loaded
+        except KeyError:
+            return False, None, None
+
+    def forget_attributes(self, *attrnames):
+        """Forget cached attributes, given by name or all of them. Return the number of attributes forgotten."""
+        cache = self._attributes_cache()
+        names = [name for name in attrnames if name in cache] if attrnames else list(cache)
+        for name in names:
+            del cache[name]
+        return len(names)
+
     async def attribute(self, attrname, task=None):
         """Load an attribute of this task, whether it is defined as a function or a task."""
         def _is_task_function(func):
@@ -237,7 +551,47 @@ class Variable(metaclass=_VariableMeta):
                 result = await attribute_task(self)
         else:
             result = attribute_task(self)
-        return _autobox(result)
+        result = _autobox(result)
+        if getattr(attribute_task, '_cached_attribute', False):
+            self._attributes_cache()[attrname] = (time.monotonic(), result)
+        return result
+
+
+def _slot_names(cls):
+    """Names of the attributes in the `__slots__` of a class and its bases."""
+    return [name for klass in cls.__mro__ for name in klass.__dict__.get('__slots__', ())
+            if name not in ('__dict__', '__weakref__')]
+
+
+class VariableStore(UserDict):
+    """
+    Variables of a session, by name.
+
+    Adding or removing a variable, or changing its type, changes how command lines are lexed, so it bumps the
+    lexing generation.
+    """
+
+    def __setitem__(self, name, variable):
+        """Set a variable."""
+        previous = self.data.get(name)
+        self.data[name] = variable
+        if previous is not None:
+            self._forget(previous)
+        # Assigning a variable again gets fresh attributes
+        variable.forget_attributes()
+        if previous is None or previous.type().class_name != variable.type().class_name:
+            generation.bump()
+
+    def __delitem__(self, name):
+        """Remove a variable."""
+        self._forget(self.data.pop(name))
+        generation.bump()
+
+    def _forget(self, variable):
+        # Nobody can use the items of a streaming list not stored anymore, under any name
+        if hasattr(variable, 'stop') and not any(value is variable for value in self.data.values()):
+            variable.stop()
+
 
 # Loads all variables
 from . import vars
@@ -1,4 +1,4 @@
 """Module with all the variable types."""
 
-from .basic import Integer, List, String
+from .basic import Integer, List, StreamingList, String
 from .link import Link
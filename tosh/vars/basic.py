@@ -1,9 +1,26 @@
 """Basic variable types."""
+import asyncio
 import functools
 
+from ..tasks import task
 from ..variable import Variable
 
 
+# Attributes objects of lists, by (attributes class, item class), see `_shared_attributes`
+_attributes_by_item_class = {}
+
+
+def _shared_attributes(attributes_class, item_class):
+    """Return the attributes object of lists of an item class, shared by all of them if the item class is a type."""
+    if not isinstance(item_class, type):
+        # Lists of lists, not worth keeping every inner list type alive
+        return attributes_class(item_class)
+    key = (attributes_class, item_class)
+    if key not in _attributes_by_item_class:
+        _attributes_by_item_class[key] = attributes_class(item_class)
+    return _attributes_by_item_class[key]
+
+
 class List(Variable):
     """List of things."""
 
@@ -27,7 +44,7 @@ class List(Variable):
         Just passing the item_class can be used to represent the type of this list to use as a return_type.
         Passing both the type and list of items (even if empty) creates the actual list.
         """
-        self.attributes = List._ListAttributes(item_class)
+        self.attributes = _shared_attributes(List._ListAttributes, item_class)
         self._item_class = item_class
         self._items = items
 
@@ -49,6 +66,10 @@ class List(Variable):
         """
         return self._items[key]
 
+    async def items(self):
+        """Return all the items of the list (waiting for them if they are still arriving, see `StreamingList`)."""
+        return self._items
+
     def count(self):
         """
         Get the number of elements on the list.
@@ -60,20 +81,150 @@ class List(Variable):
     def tokens(self):
         """Show the elements inside the list."""
         tokens = []
-        for idx, it in enumerate(self._items):
-            tokens.append(self._token(' [{:>02}] '.format(idx)))
-            tokens += it.tokens()
-            tokens.append(self._token('\n'))
+        for idx in range(len(self._items)):
+            tokens += self.item_tokens(idx)
         return tokens
 
+    def item_tokens(self, idx):
+        """Show an element of the list, in its own line."""
+        return [self._token(' [{:>02}] '.format(idx))] + self._items[idx].tokens() + [self._token('\n')]
+
     def type(self):
         """The type of the list, when this class is acting as the metaclass."""
         return self
 
 
+class StreamingList(List):
+    """
+    List filled in from an async iterator of items, e.g: rows of a long query result. The source can also be an async
+    context manager giving the iterator, entered while reading (e.g: a `CommandStream`, see
+    `SSHConsoleHandler.stream_list`). If given, `make_item` creates the items from what the source gives.
+
+    The list can be assigned and shown as soon as it is created. Accessing an item or the count waits for the items
+    needed. The producer is paused when it gets more than `window` items ahead of the highest item accessed (or of the
+    first `window` items if none is accessed), until more are needed. Call `stop()` to stop it early, which also
+    happens when the list is not stored in any variable anymore.
+
+    Listeners added with `add_listener` are called with the index of the first new item whenever items arrive, and
+    with None when the list is complete.
+    """
+
+    class _StreamingAttributes:
+        def __getitem__(self, key):
+            try:
+                key = int(key)
+            except ValueError:
+                if key != 'count':
+                    raise KeyError(key)
+                return (Integer, StreamingList.wait_count)
+            get_item = functools.partial(StreamingList.wait_item, key=key)
+            get_item._returns_task = True  # See Variable.attribute, partial loses the flag of the task function
+            return (self._item_class, get_item)
+
+        def __init__(self, item_class):
+            self._item_class = item_class
+
+    def __init__(self, tosh, item_class, source, window=1000, make_item=None):
+        """Create a list of `item_class` variables from an async iterator, starting to read it right away."""
+        super().__init__(item_class, [])
+        self.attributes = _shared_attributes(StreamingList._StreamingAttributes, item_class)
+        self._tosh = tosh
+        self._source = source
+        self._make_item = make_item
+        self._window = window
+        self._wanted = 0
+        self._waiters = []
+        self._listeners = []
+        self.finished = False
+        self.error = None
+        self._producer = asyncio.ensure_future(self._produce())
+
+    def add_listener(self, callback):
+        """Call `callback(index)` when items arrive from that index on, and `callback(None)` when complete."""
+        self._listeners.append(callback)
+
+    def stop(self):
+        """Stop reading items. The list keeps the items read so far."""
+        self._producer.cancel()
+
+    async def _produce(self):
+        managed = hasattr(self._source, '__aenter__')
+        try:
+            if managed:
+                async with self._source as source:
+                    await self._read(source)
+            else:
+                await self._read(self._source)
+        except asyncio.CancelledError:
+            self.error = 'stopped'
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.finished = True
+            closer = getattr(self._source, 'aclose', None)
+            if closer is not None and not managed:
+                asyncio.ensure_future(closer())
+            for listener in self._listeners:
+                listener(None)
+            self._wake_up()
+
+    async def _read(self, source):
+        async for item in source:
+            self._items.append(item if self._make_item is None else self._make_item(item))
+            for listener in self._listeners:
+                listener(len(self._items) - 1)
+            self._wake_up()
+            while len(self._items) >= max(self._wanted, 1) + self._window:
+                await self._changed()
+
+    def _changed(self):
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        return waiter
+
+    def _wake_up(self):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _wait_for(self, count):
+        if count > self._wanted:
+            self._wanted = count
+            self._wake_up()
+        while len(self._items) < count and not self.finished:
+            await self._changed()
+
+    async def items(self):
+        """Return all the items, once all of them arrived."""
+        await self._wait_for(float('inf'))
+        return self._items
+
+    @task('Waiting for all items')
+    async def wait_count(self, task):
+        """Number of items, once all of them arrived."""
+        return len(await self.items())
+
+    @task('Waiting for item {kw[key]}')
+    async def wait_item(self, key, task):
+        """Get an item, waiting for it to arrive."""
+        await self._wait_for(key + 1)
+        return self._items[key]
+
+    def progress_tokens(self):
+        """Tokens describing the state of the list while it is not complete, or if it ended early."""
+        if not self.finished:
+            return [self._token('… {} items so far'.format(len(self._items)))]
+        if self.error is not None:
+            return [self._token('Ended after {} items: {}'.format(len(self._items), self.error))]
+        return []
+
+
 class String(Variable):
     """Represents a string."""
 
+    __slots__ = ('string',)
+
     def __init__(self, tosh, string):
         """Wrap a string in a variable."""
         super().__init__(tosh)
@@ -91,6 +242,8 @@ class String(Variable):
 class Integer(Variable):
     """Represents an integer."""
 
+    __slots__ = ('_integer',)
+
     def __init__(self, tosh, integer):
         """Wrap an integer in a variable."""
         super().__init__(tosh)
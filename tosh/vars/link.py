@@ -1,29 +1,18 @@
 """HTTP link parsing and variables."""
 from urllib.parse import urlparse
-import aiodns
 
-from ..tasks import task, Task
+from .. import generation
+from ..tasks import task
 from ..variable import Variable, LoadVariableTask
 
 
 class _LoadLinkTask(LoadVariableTask):
+    __slots__ = ()
+
     def __init__(self, tosh, return_type, url, loader):
         super().__init__(tosh, return_type, url)
         self._loader = loader
 
-    async def run(self):
-        self._status = Task.Status.Running
-        self._tosh.refresh()
-        try:
-            result = await self._loader._load(self._argument, self)
-            self._status = Task.Status.Success
-            return result
-        except BaseException as e:
-            self._status = Task.Status.Error
-            raise e
-        finally:
-            self._tosh.refresh()
-
 
 class Link(Variable):
     """
@@ -47,7 +36,13 @@ class Link(Variable):
     @classmethod
     def load_task(cls, tosh, argument):
         """Return a task to initialize an instance of this variable."""
-        return _LoadLinkTask(tosh, Link._link_type(argument)[1], argument, Link._link_type(argument)[0])
+        loader, return_type = Link._link_type(argument)
+        return _LoadLinkTask(tosh, return_type, argument, loader)
+
+    @classmethod
+    def load_type(cls, argument):
+        """Return the type of the variable loaded for a link."""
+        return Link._link_type(argument)[1]
 
     @classmethod
     @task("Loading {pos[0].class_name} {pos[1]}")
@@ -59,4 +54,5 @@ class Link(Variable):
 def register_link(cls):
     """Decorator, register a link subclass."""
     Link._classes.append(cls)
+    generation.bump()
     return cls